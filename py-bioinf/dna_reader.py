@@ -0,0 +1,185 @@
+import gzip
+import mmap
+
+import numpy as np
+
+NUCLEOTIDES = ['A', 'T', 'G', 'C']
+GZIP_MAGIC = b'\x1f\x8b'
+READ_CHUNK_SIZE = 1 << 24
+
+# A, T, G, C -> 0, 1, 2, 3 (lowercase too) and back; any other byte (N and other ambiguity
+# codes) encodes to UNKNOWN_CODE, which decodes to N and never matches a nucleotide
+UNKNOWN_CODE = len(NUCLEOTIDES)
+ENCODING = np.full(256, UNKNOWN_CODE, dtype=np.uint8)
+ENCODING[[ord(cur_c) for cur_c in NUCLEOTIDES]] = np.arange(len(NUCLEOTIDES))
+ENCODING[[ord(cur_c.lower()) for cur_c in NUCLEOTIDES]] = np.arange(len(NUCLEOTIDES))
+DECODING = np.array([ord(cur_c) for cur_c in NUCLEOTIDES + ['N']], dtype=np.uint8)
+
+__WHITESPACE = np.zeros(256, dtype=bool)
+__WHITESPACE[[ord(cur_c) for cur_c in ' \t\r\n']] = True
+
+
+def __load_buffer(file_name):
+    with open(file_name, 'rb') as file:
+        is_gzip = file.read(len(GZIP_MAGIC)) == GZIP_MAGIC
+        if not is_gzip:
+            file.seek(0, 2)
+            if file.tell() == 0:
+                return np.zeros(0, dtype=np.uint8)
+            # private copy-on-write mapping: sequences are encoded in place, the file is never written
+            return np.frombuffer(mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_COPY), dtype=np.uint8)
+
+    result = bytearray()
+    with gzip.open(file_name, 'rb') as file:
+        while True:
+            cur_chunk = file.read(READ_CHUNK_SIZE)
+            if len(cur_chunk) == 0:
+                break
+            result += cur_chunk
+    return np.frombuffer(result, dtype=np.uint8)
+
+
+def __find_non_whitespace(buffer, lo, hi, backwards):
+    # first (or, backwards, last) non-whitespace position in every sorted disjoint [lo, hi) range,
+    # hi (or lo - 1) when the range is whitespace only; the buffer is scanned one chunk at a time
+    result = lo - 1 if backwards else hi.copy()
+    pending = np.ones(len(lo), dtype=bool)
+    chunk_starts = range(0, len(buffer), READ_CHUNK_SIZE)
+    for chunk_start in (reversed(chunk_starts) if backwards else chunk_starts):
+        chunk_end = min(chunk_start + READ_CHUNK_SIZE, len(buffer))
+        first, stop = np.searchsorted(hi, chunk_start, side='right'), np.searchsorted(lo, chunk_end)
+        cur = np.flatnonzero(pending[first:stop]) + first
+        if len(cur) == 0:
+            continue
+        non_whitespace = np.flatnonzero(~__WHITESPACE[buffer[chunk_start:chunk_end]]) + chunk_start
+        if len(non_whitespace) == 0:
+            continue
+
+        if backwards:
+            idx = np.searchsorted(non_whitespace, np.minimum(hi[cur], chunk_end)) - 1
+            pos = non_whitespace[np.maximum(idx, 0)]
+            found = (idx >= 0) & (pos >= lo[cur])
+        else:
+            idx = np.searchsorted(non_whitespace, np.maximum(lo[cur], chunk_start))
+            pos = non_whitespace[np.minimum(idx, len(non_whitespace) - 1)]
+            found = (idx < len(non_whitespace)) & (pos < hi[cur])
+        result[cur[found]] = pos[found]
+        pending[cur[found]] = False
+    return result
+
+
+def __get_lines(buffer):
+    newlines = np.concatenate([np.zeros(0, dtype=np.int64)] + [
+        np.flatnonzero(buffer[chunk_start:chunk_start + READ_CHUNK_SIZE] == ord('\n')) + chunk_start
+        for chunk_start in range(0, len(buffer), READ_CHUNK_SIZE)
+    ])
+    starts = np.concatenate(([0], newlines + 1))
+    ends = np.concatenate((newlines, [len(buffer)]))
+    if starts[-1] == len(buffer):
+        starts = starts[:-1]
+        ends = ends[:-1]
+
+    # only lines that begin or end with whitespace are searched for their non-whitespace bytes
+    non_empty = starts < ends
+    last = max(len(buffer) - 1, 0)
+    to_strip = non_empty & __WHITESPACE[buffer[np.minimum(starts, last)]]
+    starts[to_strip] = __find_non_whitespace(buffer, starts[to_strip], ends[to_strip], False)
+    to_strip = non_empty & (starts < ends) & __WHITESPACE[buffer[np.maximum(ends - 1, 0)]]
+    ends[to_strip] = __find_non_whitespace(buffer, starts[to_strip], ends[to_strip], True) + 1
+    return starts, ends
+
+
+def __encode_in_place(sequence):
+    # np.take turns the bytes into intp indices first, so a chunk at a time keeps that copy small
+    for chunk_start in range(0, len(sequence), READ_CHUNK_SIZE):
+        cur_chunk = sequence[chunk_start:chunk_start + READ_CHUNK_SIZE]
+        np.take(ENCODING, cur_chunk, out=cur_chunk)
+
+
+def __compact_lines(buffer, starts, ends):
+    # move the bytes of every line to the front of the buffer, one chunk at a time so that the
+    # masks and copies stay chunk-sized; the write position never passes the read position
+    write_pos = 0
+    for chunk_start in range(0, len(buffer), READ_CHUNK_SIZE):
+        chunk_end = min(chunk_start + READ_CHUNK_SIZE, len(buffer))
+        # whether chunk_start lies inside a line, then +1 at every line start, -1 at every line end
+        started = np.searchsorted(starts, [chunk_start, chunk_end - 1], side='right')
+        ended = np.searchsorted(ends, [chunk_start, chunk_end - 1], side='right')
+        delta = np.zeros(chunk_end - chunk_start, dtype=np.int8)
+        delta[0] = started[0] - ended[0]
+        np.add.at(delta, starts[started[0]:started[1]] - chunk_start, 1)
+        np.add.at(delta, ends[ended[0]:ended[1]] - chunk_start, -1)
+        kept = buffer[chunk_start:chunk_end][np.cumsum(delta, dtype=np.int8) > 0]
+        buffer[write_pos:write_pos + len(kept)] = kept
+        write_pos += len(kept)
+    return write_pos
+
+
+def encode_dna(dna):
+    if isinstance(dna, np.ndarray):
+        assert dna.dtype == np.uint8 and np.all(dna <= UNKNOWN_CODE)
+        return dna
+    return ENCODING[np.frombuffer(dna.encode('ascii'), dtype=np.uint8)]
+
+
+def decode_dna(encoded_dna):
+    return DECODING[encoded_dna].tobytes().decode('ascii')
+
+
+def read_sequences(file_name, skip_lines=0):
+    # returns the first skip_lines lines as strings and every sequence after them as a uint8 view
+    # (A, T, G, C, other -> 0, 1, 2, 3, 4) into one buffer; plain files hold one sequence per
+    # line, FASTA records may span several lines, and gzipped input of either kind is decompressed
+    # in memory
+    buffer = __load_buffer(file_name)
+    starts, ends = __get_lines(buffer)
+    assert len(starts) >= skip_lines
+    skipped = [
+        bytes(buffer[cur_start:cur_end]).decode('ascii')
+        for cur_start, cur_end in zip(starts[:skip_lines], ends[:skip_lines])
+    ]
+
+    starts = starts[skip_lines:]
+    ends = ends[skip_lines:]
+    # ';' lines are FASTA comments, they are dropped so that only '>' starts a record
+    kept = (starts < ends) & (buffer[np.minimum(starts, max(len(buffer) - 1, 0))] != ord(';'))
+    starts = starts[kept]
+    ends = ends[kept]
+    if len(starts) == 0:
+        return skipped, []
+
+    is_header = buffer[starts] == ord('>')
+    if not np.any(is_header):
+        result = [buffer[cur_start:cur_end] for cur_start, cur_end in zip(starts, ends)]
+        for cur_sequence in result:
+            __encode_in_place(cur_sequence)
+        return skipped, result
+
+    assert is_header[0]
+    record_ids = np.cumsum(is_header) - 1
+    starts = starts[~is_header]
+    ends = ends[~is_header]
+    lengths = np.bincount(record_ids[~is_header], weights=ends - starts, minlength=record_ids[-1] + 1)
+    lengths = lengths.astype(np.int64)
+
+    total_len = int(lengths.sum())
+    assert __compact_lines(buffer, starts, ends) == total_len
+    __encode_in_place(buffer[:total_len])
+
+    offsets = np.concatenate(([0], np.cumsum(lengths)))
+    result = [buffer[offsets[i]:offsets[i + 1]] for i in range(len(lengths))]
+    return skipped, result
+
+
+def gen_planted_dnas(k, t, dna_len, mutations, rng):
+    motif = [rng.choice(NUCLEOTIDES) for _ in range(k)]
+    dnas = []
+    for _ in range(t):
+        cur_dna = [rng.choice(NUCLEOTIDES) for _ in range(dna_len)]
+        cur_motif = list(motif)
+        for pos in rng.sample(range(k), mutations):
+            cur_motif[pos] = rng.choice(NUCLEOTIDES)
+        start_idx = rng.randint(0, dna_len - k)
+        cur_dna[start_idx:start_idx + k] = cur_motif
+        dnas.append(''.join(cur_dna))
+    return dnas
@@ -0,0 +1,16 @@
+import sys
+
+
+def deep_getsizeof(obj, seen=None):
+    # bytes held by obj and everything reachable from it through dicts, lists, tuples and sets
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    result = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        result += sum(deep_getsizeof(key, seen) + deep_getsizeof(value, seen) for key, value in obj.items())
+    elif isinstance(obj, (list, tuple, set)):
+        result += sum(deep_getsizeof(cur_elem, seen) for cur_elem in obj)
+    return result
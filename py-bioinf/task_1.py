@@ -1,9 +1,23 @@
+import random
+import time
+from itertools import combinations, product
+from multiprocessing import Pool
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from dna_reader import NUCLEOTIDES, decode_dna, encode_dna, gen_planted_dnas, read_sequences
+
+VECTORIZED_BATCH_CELLS = 1 << 24
+PARALLEL_PREFIX_LEN = 3
+
+
 def __gen_all_patterns(cur_pattern, pattern_len):
     assert len(cur_pattern) <= pattern_len
     if len(cur_pattern) == pattern_len:
         yield ''.join(cur_pattern)
     else:
-        for cur_c in ['A', 'T', 'G', 'C']:
+        for cur_c in NUCLEOTIDES:
             cur_pattern.append(cur_c)
             yield from __gen_all_patterns(cur_pattern, pattern_len)
             cur_pattern.pop()
@@ -45,13 +59,103 @@ def dist_all(pattern, texts):
     )
 
 
-def find_best_pattern(pattern_len, texts):
-    assert len(
-        set(
-            (len(cur_text) for cur_text in texts)
+def pattern_to_int(pattern):
+    # 2 bits per symbol, first symbol in the highest bits: integer order is gen_all_patterns order
+    result = 0
+    for cur_code in encode_dna(pattern):
+        result = (result << 2) | int(cur_code)
+    return result
+
+
+def int_to_pattern(pattern_int, pattern_len):
+    assert 0 <= pattern_int < 4 ** pattern_len
+    return decode_dna(ints_to_codes(np.array([pattern_int]), pattern_len)[0])
+
+
+def ints_to_codes(pattern_ints, pattern_len):
+    shifts = 2 * np.arange(pattern_len - 1, -1, -1, dtype=np.int64)
+    return ((np.asarray(pattern_ints, dtype=np.int64)[:, None] >> shifts) & 3).astype(np.uint8)
+
+
+class KMerDistanceEngine:
+    def __init__(self, texts, pattern_len):
+        encoded_texts = [encode_dna(cur_text) for cur_text in texts]
+        assert len(encoded_texts) > 0
+        assert len(set(len(cur_text) for cur_text in encoded_texts)) == 1
+        assert len(encoded_texts[0]) >= pattern_len
+
+        self.pattern_len = pattern_len
+        self.texts = np.stack(encoded_texts)
+        # (texts, windows, pattern_len) view over self.texts, no k-mer is copied
+        self.windows = sliding_window_view(self.texts, pattern_len, axis=1)
+
+    def dist_all(self, pattern):
+        codes = encode_dna(pattern)
+        assert len(codes) == self.pattern_len
+        mismatches = np.count_nonzero(self.windows != codes, axis=2)
+        return int(mismatches.min(axis=1).sum())
+
+    def dist_all_batch(self, patterns):
+        codes = np.asarray(patterns, dtype=np.uint8)
+        assert codes.ndim == 2 and codes.shape[1] == self.pattern_len
+        mismatches = np.count_nonzero(
+            self.windows[None, :, :, :] != codes[:, None, None, :], axis=3
         )
-    ) == 1
+        return mismatches.min(axis=2).sum(axis=1)
+
+    def batch_size(self):
+        return max(1, VECTORIZED_BATCH_CELLS // self.windows[0].size // len(self.texts))
+
+
+class SearchState:
+    def __init__(self):
+        self.min_dist = None
+        self.best_pattern = None
+        self.pruned = 0
+
+
+def __branch_and_bound(texts, pattern_len, cur_pattern, partial_dists, state):
+    # partial_dists[t][s] is the Hamming distance between cur_pattern and the prefix
+    # of the k-mer starting at s in texts[t]; extending the pattern can only increase it
+    lower_bound = sum(min(cur_dists) for cur_dists in partial_dists)
+    if len(cur_pattern) == pattern_len:
+        if state.min_dist is None or lower_bound < state.min_dist:
+            state.min_dist = lower_bound
+            state.best_pattern = ''.join(cur_pattern)
+        return
+
+    # patterns are visited in the same order as gen_all_patterns, so a subtree that
+    # can only tie with the best total is skipped too: the serial scan keeps the first one
+    if state.min_dist is not None and lower_bound >= state.min_dist:
+        state.pruned += 4 ** (pattern_len - len(cur_pattern))
+        return
+
+    pos = len(cur_pattern)
+    for cur_c in NUCLEOTIDES:
+        new_dists = [
+            [
+                cur_dist if cur_text[start_idx + pos] == cur_c else cur_dist + 1
+                for start_idx, cur_dist in enumerate(cur_dists)
+            ]
+            for cur_text, cur_dists in zip(texts, partial_dists)
+        ]
+        cur_pattern.append(cur_c)
+        __branch_and_bound(texts, pattern_len, cur_pattern, new_dists, state)
+        cur_pattern.pop()
 
+
+def find_best_pattern_branch_and_bound(pattern_len, texts):
+    assert all(len(cur_text) >= pattern_len for cur_text in texts)
+    state = SearchState()
+    partial_dists = [
+        [0 for _ in range(len(cur_text) - pattern_len + 1)] for cur_text in texts
+    ]
+    __branch_and_bound(texts, pattern_len, [], partial_dists, state)
+    assert state.min_dist is not None and state.best_pattern is not None
+    return state.best_pattern, state.min_dist, state.pruned
+
+
+def __find_best_pattern_exhaustive(pattern_len, texts):
     min_dist = None
     best_pattern = None
 
@@ -65,12 +169,255 @@ def find_best_pattern(pattern_len, texts):
     return best_pattern
 
 
+def __find_best_pattern_branch_and_bound(pattern_len, texts):
+    best_pattern, _, _ = find_best_pattern_branch_and_bound(pattern_len, texts)
+    return best_pattern
+
+
+def __find_best_pattern_vectorized(pattern_len, texts):
+    engine = KMerDistanceEngine(texts, pattern_len)
+    batch_size = engine.batch_size()
+    min_dist = None
+    best_pattern_int = None
+
+    for batch_start in range(0, 4 ** pattern_len, batch_size):
+        batch_ints = np.arange(batch_start, min(batch_start + batch_size, 4 ** pattern_len))
+        dists = engine.dist_all_batch(ints_to_codes(batch_ints, pattern_len))
+        # argmin returns the first minimum, the same pattern the serial scan keeps
+        batch_best = int(np.argmin(dists))
+        if min_dist is None or dists[batch_best] < min_dist:
+            min_dist = int(dists[batch_best])
+            best_pattern_int = int(batch_ints[batch_best])
+
+    assert min_dist is not None and best_pattern_int is not None
+    return int_to_pattern(best_pattern_int, pattern_len)
+
+
+__worker_texts = None
+
+
+def __init_worker(texts):
+    global __worker_texts
+    __worker_texts = texts
+
+
+def __find_best_in_shard(shard):
+    prefix_idx, prefix, suffix_len = shard
+    min_dist = None
+    best_pattern = None
+
+    for cur_suffix in gen_all_patterns(suffix_len):
+        cur_pattern = prefix + cur_suffix
+        cur_dist = dist_all(cur_pattern, __worker_texts)
+        if min_dist is None or cur_dist < min_dist:
+            min_dist = cur_dist
+            best_pattern = cur_pattern
+
+    assert min_dist is not None and best_pattern is not None
+    return prefix_idx, best_pattern, min_dist
+
+
+def find_best_pattern_parallel(pattern_len, texts, workers=None, prefix_len=PARALLEL_PREFIX_LEN):
+    prefix_len = min(prefix_len, pattern_len)
+    shards = [
+        (prefix_idx, prefix, pattern_len - prefix_len)
+        for prefix_idx, prefix in enumerate(gen_all_patterns(prefix_len))
+    ]
+
+    # texts are sent to every worker once by the initializer, tasks carry only the prefix
+    with Pool(processes=workers, initializer=__init_worker, initargs=(list(texts),)) as pool:
+        results = list(pool.imap_unordered(__find_best_in_shard, shards))
+
+    # shards are numbered in gen_all_patterns order and every shard keeps its first minimum,
+    # so the smallest (distance, shard) pair is the pattern the serial scan returns
+    _, best_pattern, min_dist = min(results, key=lambda result: (result[2], result[0]))
+    return best_pattern, min_dist
+
+
+def __find_best_pattern_parallel(pattern_len, texts, workers=None, prefix_len=PARALLEL_PREFIX_LEN):
+    best_pattern, _ = find_best_pattern_parallel(pattern_len, texts, workers, prefix_len)
+    return best_pattern
+
+
+def gen_gray_code_patterns(pattern_len):
+    # reflected base-4 Gray code: consecutive patterns differ in exactly one position;
+    # digits[j] holds the symbol at position pattern_len - 1 - j
+    digits = [0 for _ in range(pattern_len)]
+    directions = [1 for _ in range(pattern_len)]
+    pattern_int = 0
+    yield pattern_int, None, None, None
+
+    for step in range(1, 4 ** pattern_len):
+        digit_idx = 0
+        while step % 4 == 0:
+            step //= 4
+            digit_idx += 1
+
+        old_code = digits[digit_idx]
+        new_code = old_code + directions[digit_idx]
+        assert 0 <= new_code < 4
+        digits[digit_idx] = new_code
+        for lower_idx in range(digit_idx):
+            directions[lower_idx] = -directions[lower_idx]
+
+        pattern_int ^= (old_code ^ new_code) << (2 * digit_idx)
+        yield pattern_int, pattern_len - 1 - digit_idx, old_code, new_code
+
+
+def gen_distance_landscape(pattern_len, texts):
+    engine = KMerDistanceEngine(texts, pattern_len)
+    # matches[pos][code][t][s] is 1 when the k-mer starting at s in texts[t] has `code` at `pos`
+    matches = [
+        [(engine.windows[:, :, pos] == cur_code).astype(np.int32) for cur_code in range(4)]
+        for pos in range(pattern_len)
+    ]
+    dists = np.count_nonzero(engine.windows, axis=2).astype(np.int32)
+
+    for pattern_int, pos, old_code, new_code in gen_gray_code_patterns(pattern_len):
+        if pos is not None:
+            dists += matches[pos][old_code]
+            dists -= matches[pos][new_code]
+        yield pattern_int, int(dists.min(axis=1).sum())
+
+
+def __find_best_pattern_gray_code(pattern_len, texts):
+    _, best_pattern_int = min(
+        (cur_dist, pattern_int) for pattern_int, cur_dist in gen_distance_landscape(pattern_len, texts)
+    )
+    return int_to_pattern(best_pattern_int, pattern_len)
+
+
+def __gen_mismatch_masks(pattern_len, mismatches):
+    # XOR with a non-zero 2-bit value changes a symbol, so every mask flips exactly `mismatches` symbols
+    masks = [0]
+    for positions in combinations(range(pattern_len), mismatches):
+        shifts = [2 * (pattern_len - 1 - pos) for pos in positions]
+        masks.extend(
+            sum(cur_change << cur_shift for cur_change, cur_shift in zip(changes, shifts))
+            for changes in product((1, 2, 3), repeat=mismatches)
+        )
+    return np.array(masks[1:] if mismatches > 0 else masks, dtype=np.int64)
+
+
+def gen_text_k_mer_ints(texts, pattern_len):
+    weights = 4 ** np.arange(pattern_len - 1, -1, -1, dtype=np.int64)
+    # an unknown base mismatches every pattern, so reading it as A can only bring a k-mer closer
+    # to a pattern and the neighborhoods still cover everything the stopping bound relies on
+    k_mer_ints = [
+        sliding_window_view((encode_dna(cur_text) & 3).astype(np.int64), pattern_len) @ weights
+        for cur_text in texts
+    ]
+    return np.unique(np.concatenate(k_mer_ints))
+
+
+def gen_neighborhood_candidates(texts, pattern_len):
+    k_mer_ints = gen_text_k_mer_ints(texts, pattern_len)
+    visited = np.zeros((4 ** pattern_len + 7) // 8, dtype=np.uint8)
+
+    for mismatches in range(pattern_len + 1):
+        masks = __gen_mismatch_masks(pattern_len, mismatches)
+        chunk_size = max(1, VECTORIZED_BATCH_CELLS // len(masks))
+        for chunk_start in range(0, len(k_mer_ints), chunk_size):
+            chunk = k_mer_ints[chunk_start:chunk_start + chunk_size]
+            candidates = np.unique((chunk[:, None] ^ masks[None, :]).ravel())
+            is_visited = (visited[candidates >> 3] >> (candidates & 7).astype(np.uint8)) & 1
+            candidates = candidates[is_visited == 0]
+            np.bitwise_or.at(visited, candidates >> 3, (1 << (candidates & 7)).astype(np.uint8))
+            yield mismatches, candidates
+
+
+def find_best_pattern_neighborhood(pattern_len, texts):
+    engine = KMerDistanceEngine(texts, pattern_len)
+    batch_size = engine.batch_size()
+    min_dist = None
+    best_pattern_int = None
+    scored = 0
+
+    for mismatches, candidates in gen_neighborhood_candidates(texts, pattern_len):
+        # every pattern outside the (mismatches - 1)-neighborhoods is at least `mismatches`
+        # away from each text, so nothing left can beat min_dist; a strict comparison also
+        # rules out an unseen pattern that ties and comes first in gen_all_patterns order
+        if min_dist is not None and min_dist < len(texts) * mismatches:
+            break
+
+        for batch_start in range(0, len(candidates), batch_size):
+            batch_ints = candidates[batch_start:batch_start + batch_size]
+            dists = engine.dist_all_batch(ints_to_codes(batch_ints, pattern_len))
+            scored += len(batch_ints)
+            # candidates are sorted, so the first minimum is also the smallest pattern
+            batch_best = int(np.argmin(dists))
+            cur_dist = int(dists[batch_best])
+            cur_int = int(batch_ints[batch_best])
+            if min_dist is None or (cur_dist, cur_int) < (min_dist, best_pattern_int):
+                min_dist = cur_dist
+                best_pattern_int = cur_int
+
+    assert min_dist is not None and best_pattern_int is not None
+    return int_to_pattern(best_pattern_int, pattern_len), min_dist, scored
+
+
+def __find_best_pattern_neighborhood(pattern_len, texts):
+    best_pattern, _, _ = find_best_pattern_neighborhood(pattern_len, texts)
+    return best_pattern
+
+
+# these modes walk Python strings, encoded texts are decoded for them first
+STRING_MODES = {'exhaustive', 'branch_and_bound', 'parallel'}
+
+SEARCH_MODES = {
+    'exhaustive': __find_best_pattern_exhaustive,
+    'branch_and_bound': __find_best_pattern_branch_and_bound,
+    'vectorized': __find_best_pattern_vectorized,
+    'parallel': __find_best_pattern_parallel,
+    'neighborhood': __find_best_pattern_neighborhood,
+    'gray_code': __find_best_pattern_gray_code
+}
+
+
+def find_best_pattern(pattern_len, texts, mode='exhaustive', **options):
+    assert len(
+        set(
+            (len(cur_text) for cur_text in texts)
+        )
+    ) == 1
+    assert mode in SEARCH_MODES
+    if mode in STRING_MODES:
+        texts = [cur_text if isinstance(cur_text, str) else decode_dna(cur_text) for cur_text in texts]
+    return SEARCH_MODES[mode](pattern_len, texts, **options)
+
+
+def benchmark_neighborhood(pattern_lens=range(8, 15), texts_count=10, text_len=100, mutations=2,
+                           exhaustive_limit=4 ** 9, seed=0):
+    rnd = random.Random(seed)
+    print('k\tcandidates\tneighborhood_s\texhaustive_s')
+    for pattern_len in pattern_lens:
+        texts = gen_planted_dnas(pattern_len, texts_count, text_len, mutations, rnd)
+
+        start_time = time.perf_counter()
+        best_pattern, min_dist, scored = find_best_pattern_neighborhood(pattern_len, texts)
+        neighborhood_time = time.perf_counter() - start_time
+
+        if 4 ** pattern_len <= exhaustive_limit:
+            start_time = time.perf_counter()
+            assert find_best_pattern(pattern_len, texts, mode='vectorized') == best_pattern
+            exhaustive_time = f'{time.perf_counter() - start_time:.3f}'
+        else:
+            # too slow to finish, extrapolate the rate measured on one batch
+            engine = KMerDistanceEngine(texts, pattern_len)
+            batch_ints = np.arange(min(engine.batch_size(), 4 ** pattern_len))
+            start_time = time.perf_counter()
+            engine.dist_all_batch(ints_to_codes(batch_ints, pattern_len))
+            rate = len(batch_ints) / (time.perf_counter() - start_time)
+            exhaustive_time = f'~{4 ** pattern_len / rate:.0f} (estimated)'
+
+        print(f'{pattern_len}\t{scored}\t{neighborhood_time:.3f}\t{exhaustive_time}')
+
+
 def main():
-    with open('rosalind_ba2b.txt', 'r') as file:
-        pattern_size = int(file.readline())
-        texts = [cur_line.strip() for cur_line in file.readlines()]
-        best_pattern = find_best_pattern(pattern_size, texts)
-        print(best_pattern)
+    skipped, texts = read_sequences('rosalind_ba2b.txt', skip_lines=1)
+    pattern_size = int(skipped[0])
+    best_pattern = find_best_pattern(pattern_size, texts, mode='vectorized')
+    print(best_pattern)
 
 
 if __name__ == '__main__':
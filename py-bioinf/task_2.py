@@ -1,9 +1,19 @@
+import math
 import random
+import time
+from multiprocessing import Pool, Value
 
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
 
-def gen_random_motif(dna, k):
+from dna_reader import NUCLEOTIDES, UNKNOWN_CODE, decode_dna, encode_dna, gen_planted_dnas, read_sequences
+
+LOG_TIE_TOLERANCE = 1e-9
+
+
+def gen_random_motif(dna, k, rng=random):
     assert len(dna) >= k
-    start_idx = random.randint(0, len(dna) - k)
+    start_idx = rng.randint(0, len(dna) - k)
     result = dna[start_idx:start_idx + k]
     assert len(result) == k
     return result
@@ -58,6 +68,46 @@ def get_most_probable_kmer(dna, k, counts):
     return result
 
 
+def get_count_matrix(counts):
+    # rows follow NUCLEOTIDES, so row index == encoded symbol
+    return np.array([counts[c] for c in NUCLEOTIDES], dtype=np.int64)
+
+
+def get_log_profile(count_matrix):
+    return np.log(count_matrix / count_matrix.sum(axis=0))
+
+
+def with_unknown_row(matrix, fill):
+    # adds the row for UNKNOWN_CODE, so unknown bases can index profiles directly
+    return np.vstack((matrix, np.full((1, matrix.shape[1]), fill, dtype=matrix.dtype)))
+
+
+def get_most_probable_start(encoded_dna, k, count_matrix, log_profile):
+    assert len(encoded_dna) >= k
+    assert count_matrix.shape == log_profile.shape == (4, k)
+    # an unknown base has probability 0, such a window wins only when every window has one
+    count_matrix = with_unknown_row(count_matrix, 0)
+    log_profile = with_unknown_row(log_profile, -np.inf)
+    windows = sliding_window_view(encoded_dna, k)
+    positions = np.arange(k)
+    log_probs = log_profile[windows, positions].sum(axis=1)
+
+    # log sums may round apart products that are equal, so near-maximal windows are
+    # compared exactly, keeping the first maximum as get_most_probable_kmer does
+    candidates = np.flatnonzero(log_probs >= log_probs.max() - LOG_TIE_TOLERANCE)
+    if len(candidates) == 1:
+        return int(candidates[0])
+    max_prob = -1
+    result = None
+    for start_idx in candidates:
+        cur_prob = math.prod(count_matrix[windows[start_idx], positions].tolist())
+        if cur_prob > max_prob:
+            max_prob = cur_prob
+            result = int(start_idx)
+    assert result is not None and max_prob >= 0
+    return result
+
+
 def get_most_probable_letter(counts, pos, k):
     assert 0 <= pos < k
     max_count = -1
@@ -91,37 +141,221 @@ def score(motifs):
     return result
 
 
-def randomized_motif_search(dnas, k):
-    cur_motifs = [gen_random_motif(cur_dna, k) for cur_dna in dnas]
-    best_motifs = cur_motifs
-    min_score = score(best_motifs)
+class MotifMatrix:
+    def __init__(self, motifs, counts):
+        k, t = motifs.shape
+        assert counts.shape == (4, k)
+        self.motifs = motifs  # motifs[pos][j] is the symbol of motif #j at position pos
+        self.counts = counts  # same layout and +1 pseudocounts as get_count_matrix(get_counts(...))
+        self.positions = np.arange(k)
+        self.consensus = None
+        self.score = None
+        self.__update_consensus()
+
+    @classmethod
+    def from_starts(cls, encoded_dnas, starts, k):
+        motifs = np.stack(
+            [cur_encoded[start_idx:start_idx + k] for cur_encoded, start_idx in zip(encoded_dnas, starts)],
+            axis=1
+        )
+        counts = np.ones((4, k), dtype=np.int64)
+        known = motifs != UNKNOWN_CODE
+        np.add.at(counts, (motifs[known], np.broadcast_to(np.arange(k)[:, None], motifs.shape)[known]), 1)
+        return cls(motifs, counts)
+
+    def __update_consensus(self):
+        # argmax keeps the first maximum in NUCLEOTIDES order, as get_most_probable_letter does
+        self.consensus = self.counts.argmax(axis=0)
+        k, t = self.motifs.shape
+        self.score = t * k - int((self.counts[self.consensus, self.positions] - 1).sum())
+
+    def remove_motif(self, j):
+        # unknown bases are not counted, so they mismatch the consensus and add to the score
+        known = self.motifs[:, j] != UNKNOWN_CODE
+        self.counts[self.motifs[known, j], self.positions[known]] -= 1
+
+    def add_motif(self, j, codes):
+        self.motifs[:, j] = codes
+        known = codes != UNKNOWN_CODE
+        self.counts[codes[known], self.positions[known]] += 1
+        self.__update_consensus()
+
+    def replace_motif(self, j, codes):
+        self.remove_motif(j)
+        self.add_motif(j, codes)
+
+
+def get_motifs(encoded_dnas, starts, k):
+    return [
+        decode_dna(cur_encoded[start_idx:start_idx + k]) for cur_encoded, start_idx in zip(encoded_dnas, starts)
+    ]
+
+
+def randomized_motif_search(dnas, k, encoded_dnas=None, rng=random, stats=None):
+    if encoded_dnas is None:
+        encoded_dnas = [encode_dna(cur_dna) for cur_dna in dnas]
+    assert len(encoded_dnas) == len(dnas)
+
+    starts = [rng.randint(0, len(cur_encoded) - k) for cur_encoded in encoded_dnas]
+    motif_matrix = MotifMatrix.from_starts(encoded_dnas, starts, k)
+    best_starts = starts
+    min_score = motif_matrix.score
 
     while True:
-        counts = get_counts(cur_motifs)
-        cur_motifs = [get_most_probable_kmer(cur_dna, k, counts) for cur_dna in dnas]
-        cur_score = score(cur_motifs)
-        if cur_score < min_score:
-            min_score = cur_score
-            best_motifs = cur_motifs
+        # every new motif comes from the profile of the previous ones, apply them after scoring
+        log_profile = get_log_profile(motif_matrix.counts)
+        starts = [
+            get_most_probable_start(cur_encoded, k, motif_matrix.counts, log_profile)
+            for cur_encoded in encoded_dnas
+        ]
+        for j, (cur_encoded, start_idx) in enumerate(zip(encoded_dnas, starts)):
+            motif_matrix.replace_motif(j, cur_encoded[start_idx:start_idx + k])
+        if stats is not None:
+            stats['profile_evaluations'] += sum(len(cur_encoded) - k + 1 for cur_encoded in encoded_dnas)
+
+        if motif_matrix.score < min_score:
+            min_score = motif_matrix.score
+            best_starts = starts
         else:
-            return best_motifs, min_score
+            return get_motifs(encoded_dnas, best_starts, k), min_score
 
 
-def main():
-    with open("rosalind_ba2f.txt", "r") as file:
-        k, t = map(int, file.readline().split())
-        dnas = [cur_line.strip() for cur_line in file.readlines()]
-
-        best_motif = None
-        min_score = None
-        for _ in range(1000):
-            cur_motif, cur_score = randomized_motif_search(dnas, k)
+def get_window_weights(encoded_dna, k, count_matrix):
+    windows = sliding_window_view(encoded_dna, k)
+    log_profile = with_unknown_row(get_log_profile(count_matrix), -np.inf)
+    log_probs = log_profile[windows, np.arange(k)].sum(axis=1)
+    if log_probs.max() == -np.inf:
+        # every window has an unknown base, none is more likely than another
+        return np.ones(len(log_probs))
+    return np.exp(log_probs - log_probs.max())
+
+
+def sample_start(weights, rng=random):
+    cumulative = np.cumsum(weights)
+    start_idx = int(np.searchsorted(cumulative, rng.random() * cumulative[-1], side='right'))
+    return min(start_idx, len(weights) - 1)
+
+
+def gibbs_sampler(dnas, k, iterations, encoded_dnas=None, rng=random, stats=None):
+    if encoded_dnas is None:
+        encoded_dnas = [encode_dna(cur_dna) for cur_dna in dnas]
+    assert len(encoded_dnas) == len(dnas)
+    t = len(dnas)
+
+    starts = [rng.randint(0, len(cur_encoded) - k) for cur_encoded in encoded_dnas]
+    motif_matrix = MotifMatrix.from_starts(encoded_dnas, starts, k)
+    best_starts = list(starts)
+    min_score = motif_matrix.score
+
+    for _ in range(iterations):
+        i = rng.randrange(t)
+        motif_matrix.remove_motif(i)
+        weights = get_window_weights(encoded_dnas[i], k, motif_matrix.counts)
+        starts[i] = sample_start(weights, rng)
+        motif_matrix.add_motif(i, encoded_dnas[i][starts[i]:starts[i] + k])
+        if stats is not None:
+            stats['profile_evaluations'] += len(weights)
+
+        if motif_matrix.score < min_score:
+            min_score = motif_matrix.score
+            best_starts = list(starts)
+
+    return get_motifs(encoded_dnas, best_starts, k), min_score
+
+
+def benchmark_gibbs(k=15, t=20, dna_len=1000, mutations=4, seed=0,
+                    randomized_restarts=(10, 100, 1000), gibbs_runs=((1, 2000), (5, 2000), (20, 2000))):
+    rng = random.Random(seed)
+    dnas = gen_planted_dnas(k, t, dna_len, mutations, rng)
+    encoded_dnas = [encode_dna(cur_dna) for cur_dna in dnas]
+    print('method\truns\titerations\tscore\tprofile_evaluations\tseconds')
+
+    for restarts in randomized_restarts:
+        stats = {'profile_evaluations': 0}
+        start_time = time.perf_counter()
+        min_score = min(
+            randomized_motif_search(dnas, k, encoded_dnas, rng, stats)[1] for _ in range(restarts)
+        )
+        print(f'randomized\t{restarts}\t-\t{min_score}\t{stats["profile_evaluations"]}\t'
+              f'{time.perf_counter() - start_time:.2f}')
+
+    for runs, iterations in gibbs_runs:
+        stats = {'profile_evaluations': 0}
+        start_time = time.perf_counter()
+        min_score = min(
+            gibbs_sampler(dnas, k, iterations, encoded_dnas, rng, stats)[1] for _ in range(runs)
+        )
+        print(f'gibbs\t{runs}\t{iterations}\t{min_score}\t{stats["profile_evaluations"]}\t'
+              f'{time.perf_counter() - start_time:.2f}')
+
+
+__worker_state = None
+
+
+def __init_restart_worker(dnas, k, seed, target_score, stop_at):
+    global __worker_state
+    encoded_dnas = [encode_dna(cur_dna) for cur_dna in dnas]
+    __worker_state = (dnas, encoded_dnas, k, seed, target_score, stop_at)
+
+
+def __run_restart(restart_idx):
+    dnas, encoded_dnas, k, seed, target_score, stop_at = __worker_state
+    # some restart before this one already reached the target, the driver never gets here
+    if stop_at.value < restart_idx:
+        return restart_idx, None, None
+
+    # the RNG depends on the restart only, so the worker count does not change the results
+    rng = random.Random(f'{seed}:{restart_idx}')
+    cur_motifs, cur_score = randomized_motif_search(dnas, k, encoded_dnas, rng)
+    if target_score is not None and cur_score <= target_score:
+        with stop_at.get_lock():
+            stop_at.value = min(stop_at.value, restart_idx)
+    return restart_idx, cur_motifs, cur_score
+
+
+def parallel_motif_search(dnas, k, restarts=1000, seed=0, workers=None, target_score=None, patience=None):
+    # restarts are reduced in index order, so stopping on the target or after `patience`
+    # restarts without improvement picks the same restart for any number of workers
+    stop_at = Value('q', restarts)
+    start_time = time.perf_counter()
+    history = []  # (seconds since start, restart index, new best score)
+    best_motifs = None
+    min_score = None
+    last_improvement = 0
+
+    with Pool(processes=workers, initializer=__init_restart_worker,
+              initargs=(list(dnas), k, seed, target_score, stop_at)) as pool:
+        for restart_idx, cur_motifs, cur_score in pool.imap(__run_restart, range(restarts)):
+            assert cur_motifs is not None and cur_score is not None
             if min_score is None or cur_score < min_score:
                 min_score = cur_score
-                best_motif = cur_motif
+                best_motifs = cur_motifs
+                last_improvement = restart_idx
+                history.append((time.perf_counter() - start_time, restart_idx, cur_score))
+
+            if target_score is not None and min_score <= target_score:
+                break
+            if patience is not None and restart_idx - last_improvement >= patience:
+                break
+
+    assert best_motifs is not None and min_score is not None
+    return best_motifs, min_score, history
+
+
+def main():
+    skipped, dnas = read_sequences("rosalind_ba2f.txt", skip_lines=1)
+    k, t = map(int, skipped[0].split())
+
+    best_motif = None
+    min_score = None
+    for _ in range(1000):
+        cur_motif, cur_score = randomized_motif_search(dnas, k)
+        if min_score is None or cur_score < min_score:
+            min_score = cur_score
+            best_motif = cur_motif
 
-        assert best_motif is not None and min_score is not None
-        print('\n'.join(best_motif))
+    assert best_motif is not None and min_score is not None
+    print('\n'.join(best_motif))
 
 
 if __name__ == '__main__':
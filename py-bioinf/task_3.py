@@ -1,3 +1,30 @@
+import hashlib
+import os
+import struct
+import sys
+import time
+from multiprocessing import Pool
+
+import numpy as np
+
+from dna_reader import DECODING, ENCODING, decode_dna
+from memory_usage import deep_getsizeof
+
+BASES_PER_WORD = 32
+CHUNK_SIZE = 1 << 26
+HASH_MOD = (1 << 61) - 1
+HASH_BASE = 1000003
+MAX_ASSEMBLY_RETRIES = 10 ** 6
+SNAPSHOT_MAGIC = b'BA3JGRPH'
+SNAPSHOT_VERSION = 1
+# magic, version, k, d, words per key, nodes, edges, read pairs, sha256 of the input file
+SNAPSHOT_HEADER = struct.Struct('<8sIiiIqqq32s')
+SNAPSHOT_ALIGNMENT = 64
+
+__LINE_PADDING = np.frombuffer(b' \t\r\n', dtype=np.uint8)
+__WORD_SHIFTS = np.arange(2 * (BASES_PER_WORD - 1), -1, -2, dtype=np.uint64)
+
+
 def get_suffix(p):
     assert len(p) == 2
     return p[0][1:], p[1][1:]
@@ -85,12 +112,570 @@ def assemble_genome(path, d):
     return ''.join(result)
 
 
-def main():
-    nodes, edges, n, k, d = read_graph("rosalind_ba3j.txt")
+def pack_codes(codes):
+    # 2 bits per base, BASES_PER_WORD bases per uint64 word, first base in the highest bits:
+    # four bases are packed per byte and every 8 bytes are read as a big-endian word
+    count, length = codes.shape
+    words_count = (length + BASES_PER_WORD - 1) // BASES_PER_WORD
+    padded = np.zeros((count, words_count * BASES_PER_WORD), dtype=np.uint8)
+    padded[:, :length] = codes
+    padded = padded.reshape(count, words_count * BASES_PER_WORD // 4, 4)
+    packed = (padded[:, :, 0] << 6) | (padded[:, :, 1] << 4) | (padded[:, :, 2] << 2) | padded[:, :, 3]
+    return np.ascontiguousarray(packed).view('>u8').astype(np.uint64)
+
+
+def unpack_codes(words, length):
+    count, words_count = words.shape
+    codes = (words[:, :, None] >> __WORD_SHIFTS) & np.uint64(3)
+    return codes.reshape(count, words_count * BASES_PER_WORD)[:, :length].astype(np.uint8)
+
+
+class CompactGraph:
+    def __init__(self, keys, offsets, targets, in_deg, out_deg, k, d):
+        # node v is the paired (k-1)-mer packed into keys[v]: first read, then second read;
+        # its out-edges are targets[offsets[v]:offsets[v + 1]] in input order
+        self.keys = keys
+        self.offsets = offsets
+        self.targets = targets
+        self.in_deg = in_deg
+        self.out_deg = out_deg
+        self.k = k
+        self.d = d
+        self.unitigs = None  # filled by condense_graph
+        self.unitig_of = None
+
+    def node_count(self):
+        return len(self.keys)
+
+    def edge_count(self):
+        return len(self.targets)
+
+    def nbytes(self):
+        return sum(
+            cur_array.nbytes for cur_array in (self.keys, self.offsets, self.targets, self.in_deg, self.out_deg)
+        )
+
+    def get_pairs(self, node_ids):
+        codes = unpack_codes(self.keys[np.asarray(node_ids, dtype=np.int64)], 2 * (self.k - 1))
+        texts = decode_dna(codes)
+        row_len = 2 * (self.k - 1)
+        return [
+            (texts[row_start:row_start + self.k - 1], texts[row_start + self.k - 1:row_start + row_len])
+            for row_start in range(0, len(texts), row_len)
+        ]
+
+
+def encode_read_pairs(lines, k):
+    # lines are 'first|second' read pairs, returns the two reads as (n, k) arrays of codes
+    raw = np.frombuffer(''.join(lines).encode('ascii'), dtype=np.uint8).reshape(len(lines), 2 * k + 1)
+    assert np.all(raw[:, k] == ord('|'))
+    codes = ENCODING[raw]
+    first = codes[:, :k]
+    second = codes[:, k + 1:]
+    assert np.all(first < 4) and np.all(second < 4)
+    return first, second
+
+
+def pack_prefixes_and_suffixes(first, second):
+    prefix_keys = pack_codes(np.concatenate((first[:, :-1], second[:, :-1]), axis=1))
+    suffix_keys = pack_codes(np.concatenate((first[:, 1:], second[:, 1:]), axis=1))
+    return prefix_keys, suffix_keys
+
+
+def unique_keys(keys):
+    # same result as np.unique(keys, axis=0, return_inverse=True), without sorting rows as void
+    if keys.shape[1] == 1:
+        unique, inverse = np.unique(keys[:, 0], return_inverse=True)
+        return unique[:, None], inverse.reshape(-1)
+
+    order = np.lexsort(keys.T[::-1])
+    sorted_keys = keys[order]
+    is_first = np.ones(len(keys), dtype=bool)
+    is_first[1:] = np.any(sorted_keys[1:] != sorted_keys[:-1], axis=1)
+    inverse = np.empty(len(keys), dtype=np.int64)
+    inverse[order] = np.cumsum(is_first) - 1
+    return sorted_keys[is_first], inverse
+
+
+def build_compact_graph(prefix_keys, suffix_keys, k, d):
+    edges_count = len(prefix_keys)
+    keys, node_ids = unique_keys(np.concatenate((prefix_keys, suffix_keys)))
+    sources = node_ids[:edges_count]
+    targets = node_ids[edges_count:]
+
+    # stable sort keeps the out-edges of every node in input order, as read_graph appends them
+    order = np.argsort(sources, kind='stable')
+    out_deg = np.bincount(sources, minlength=len(keys)).astype(np.int32)
+    in_deg = np.bincount(targets, minlength=len(keys)).astype(np.int32)
+    offsets = np.zeros(len(keys) + 1, dtype=np.int64)
+    np.cumsum(out_deg, out=offsets[1:])
+    return CompactGraph(keys, offsets, targets[order].astype(np.int32), in_deg, out_deg, k, d)
+
+
+def read_compact_graph(file_name):
+    with open(file_name, "r") as file:
+        k, d = map(int, file.readline().split())
+        lines = [cur_line for cur_line in map(lambda s: s.strip(), file) if cur_line != '']
+
+    first, second = encode_read_pairs(lines, k)
+    prefix_keys, suffix_keys = pack_prefixes_and_suffixes(first, second)
+    return build_compact_graph(prefix_keys, suffix_keys, k, d), len(lines), k, d
+
+
+def __get_pairs_layout(file_name):
+    # read pairs are fixed-width lines, so pair #i starts at data_start + i * stride;
+    # returns None for files that are not laid out that way
+    with open(file_name, "rb") as file:
+        k, d = map(int, file.readline().split())
+        data_start = file.tell()
+        first_line = file.readline()
+        line_len = 2 * k + 1
+        if len(first_line) < line_len or first_line[line_len:].strip() != b'':
+            return None
+        stride = len(first_line)
+
+        file_size = os.fstat(file.fileno()).st_size
+        tail_start = max(data_start, file_size - stride)
+        file.seek(tail_start)
+        data_end = tail_start + len(file.read().rstrip())
+
+    pairs_count = (data_end - data_start + stride - line_len) // stride
+    if data_start + (pairs_count - 1) * stride + line_len != data_end:
+        return None
+    return k, d, data_start, stride, pairs_count
+
+
+def __pack_pairs_range(args):
+    # returns None as soon as some line of the range does not fit the fixed-width layout
+    file_name, k, data_start, stride, first_pair, last_pair, chunk_size = args
+    line_len = 2 * k + 1
+    chunk_pairs = max(1, chunk_size // stride)
+    prefix_chunks = []
+    suffix_chunks = []
+
+    with open(file_name, "rb") as file:
+        for chunk_first in range(first_pair, last_pair, chunk_pairs):
+            chunk_last = min(chunk_first + chunk_pairs, last_pair)
+            file.seek(data_start + chunk_first * stride)
+            # the last line of the file may have no line break, pad it to the full stride
+            raw = file.read((chunk_last - chunk_first) * stride).ljust((chunk_last - chunk_first) * stride)
+            raw = np.frombuffer(raw, dtype=np.uint8).reshape(chunk_last - chunk_first, stride)
+            if not np.all(raw[:, k] == ord('|')) or not np.all(np.isin(raw[:, line_len:], __LINE_PADDING)):
+                return None
+            codes = ENCODING[raw[:, :line_len]]
+            first = codes[:, :k]
+            second = codes[:, k + 1:]
+            if not np.all(first < 4) or not np.all(second < 4):
+                return None
+
+            prefix_keys, suffix_keys = pack_prefixes_and_suffixes(first, second)
+            prefix_chunks.append(prefix_keys)
+            suffix_chunks.append(suffix_keys)
+
+    words_count = (2 * (k - 1) + BASES_PER_WORD - 1) // BASES_PER_WORD
+    empty = np.zeros((0, words_count), dtype=np.uint64)
+    return np.concatenate([empty] + prefix_chunks), np.concatenate([empty] + suffix_chunks)
+
+
+def read_compact_graph_chunked(file_name, workers=1, chunk_size=CHUNK_SIZE):
+    # files with lines of uneven width are read whole by read_compact_graph instead
+    layout = __get_pairs_layout(file_name)
+    if layout is None:
+        return read_compact_graph(file_name)
+    k, d, data_start, stride, pairs_count = layout
+    ranges_count = max(1, min(workers, pairs_count))
+    bounds = [pairs_count * i // ranges_count for i in range(ranges_count + 1)]
+    tasks = [
+        (file_name, k, data_start, stride, bounds[i], bounds[i + 1], chunk_size) for i in range(ranges_count)
+    ]
+
+    if workers == 1:
+        results = [__pack_pairs_range(cur_task) for cur_task in tasks]
+    else:
+        with Pool(processes=workers) as pool:
+            results = pool.map(__pack_pairs_range, tasks)
+    if any(cur_result is None for cur_result in results):
+        return read_compact_graph(file_name)
+
+    # ranges are merged in file order, so every node keeps its edges in input order
+    prefix_keys = np.concatenate([cur_prefixes for cur_prefixes, _ in results])
+    suffix_keys = np.concatenate([cur_suffixes for _, cur_suffixes in results])
+    return build_compact_graph(prefix_keys, suffix_keys, k, d), pairs_count, k, d
+
+
+def gen_synthetic_pairs(file_name, genome_len, k, d, seed=0):
+    rng = np.random.default_rng(seed)
+    genome = DECODING[rng.integers(0, 4, size=genome_len)]
+    pairs_count = genome_len - 2 * k - d + 1
+    assert pairs_count > 0
+
+    starts = rng.permutation(pairs_count)[:, None]
+    lines = np.empty((pairs_count, 2 * k + 2), dtype=np.uint8)
+    lines[:, :k] = genome[starts + np.arange(k)]
+    lines[:, k] = ord('|')
+    lines[:, k + 1:2 * k + 1] = genome[starts + k + d + np.arange(k)]
+    lines[:, -1] = ord('\n')
+
+    with open(file_name, "wb") as file:
+        file.write(f'{k} {d}\n'.encode('ascii'))
+        file.write(lines.tobytes())
+    return pairs_count
+
+
+def benchmark_graph_construction(pairs_count=10 ** 6, k=30, d=100, workers=(1, 4), dict_limit=10 ** 6,
+                                 file_name='synthetic_pairs.txt', seed=0):
+    gen_synthetic_pairs(file_name, pairs_count + 2 * k + d - 1, k, d, seed)
+    print('reader\tpairs_per_second')
+
+    if pairs_count <= dict_limit:
+        start_time = time.perf_counter()
+        read_graph(file_name)
+        print(f'read_graph\t{pairs_count / (time.perf_counter() - start_time):.0f}')
+
+    start_time = time.perf_counter()
+    expected, _, _, _ = read_compact_graph(file_name)
+    print(f'read_compact_graph\t{pairs_count / (time.perf_counter() - start_time):.0f}')
+
+    for cur_workers in workers:
+        start_time = time.perf_counter()
+        graph, _, _, _ = read_compact_graph_chunked(file_name, cur_workers)
+        print(f'chunked, {cur_workers} workers\t{pairs_count / (time.perf_counter() - start_time):.0f}')
+        assert np.array_equal(graph.keys, expected.keys) and np.array_equal(graph.targets, expected.targets)
+
+
+def file_checksum(file_name):
+    result = hashlib.sha256()
+    with open(file_name, 'rb') as file:
+        while True:
+            cur_chunk = file.read(CHUNK_SIZE)
+            if len(cur_chunk) == 0:
+                break
+            result.update(cur_chunk)
+    return result.digest()
+
+
+def __aligned(offset):
+    return (offset + SNAPSHOT_ALIGNMENT - 1) // SNAPSHOT_ALIGNMENT * SNAPSHOT_ALIGNMENT
+
+
+def __snapshot_layout(nodes_count, edges_count, words_count):
+    # (attribute, dtype, shape) of every array in file order, each one starting at an aligned offset
+    return [
+        ('keys', np.uint64, (nodes_count, words_count)),
+        ('offsets', np.int64, (nodes_count + 1,)),
+        ('targets', np.int32, (edges_count,)),
+        ('in_deg', np.int32, (nodes_count,)),
+        ('out_deg', np.int32, (nodes_count,))
+    ]
+
+
+def save_graph_snapshot(graph, pairs_count, snapshot_name, input_checksum):
+    header = SNAPSHOT_HEADER.pack(
+        SNAPSHOT_MAGIC, SNAPSHOT_VERSION, graph.k, graph.d, graph.keys.shape[1],
+        graph.node_count(), graph.edge_count(), pairs_count, input_checksum
+    )
+    # written next to the snapshot and renamed over it, so an interrupted run never leaves half a file
+    temp_name = f'{snapshot_name}.{os.getpid()}.tmp'
+    try:
+        with open(temp_name, 'wb') as file:
+            file.write(header)
+            layout = __snapshot_layout(graph.node_count(), graph.edge_count(), graph.keys.shape[1])
+            for attr_name, dtype, shape in layout:
+                file.write(b'\0' * (__aligned(file.tell()) - file.tell()))
+                cur_array = getattr(graph, attr_name)
+                assert cur_array.shape == shape
+                file.write(np.ascontiguousarray(cur_array, dtype=dtype).tobytes())
+        os.replace(temp_name, snapshot_name)
+    finally:
+        if os.path.exists(temp_name):
+            os.remove(temp_name)
+
+
+def load_graph_snapshot(snapshot_name, input_checksum):
+    # returns None for a missing, foreign, stale or truncated snapshot; arrays are read-only memory maps
+    if not os.path.exists(snapshot_name) or os.path.getsize(snapshot_name) < SNAPSHOT_HEADER.size:
+        return None
+    raw = np.memmap(snapshot_name, dtype=np.uint8, mode='r')
+    magic, version, k, d, words_count, nodes_count, edges_count, pairs_count, checksum = \
+        SNAPSHOT_HEADER.unpack(raw[:SNAPSHOT_HEADER.size].tobytes())
+    if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION or checksum != input_checksum:
+        return None
+
+    array_offsets = []
+    offset = SNAPSHOT_HEADER.size
+    layout = __snapshot_layout(nodes_count, edges_count, words_count)
+    for _, dtype, shape in layout:
+        offset = __aligned(offset)
+        array_offsets.append(offset)
+        offset += int(np.prod(shape)) * np.dtype(dtype).itemsize
+    if offset != len(raw):
+        return None
+
+    arrays = {}
+    for (attr_name, dtype, shape), offset in zip(layout, array_offsets):
+        nbytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        arrays[attr_name] = raw[offset:offset + nbytes].view(dtype).reshape(shape)
+
+    graph = CompactGraph(
+        arrays['keys'], arrays['offsets'], arrays['targets'], arrays['in_deg'], arrays['out_deg'], k, d
+    )
+    return graph, pairs_count, k, d
+
+
+def load_or_build_graph(file_name, snapshot_name=None, workers=1):
+    if snapshot_name is None:
+        snapshot_name = file_name + '.graph'
+    input_checksum = file_checksum(file_name)
+    result = load_graph_snapshot(snapshot_name, input_checksum)
+    if result is None:
+        result = read_compact_graph_chunked(file_name, workers)
+        graph, pairs_count, _, _ = result
+        save_graph_snapshot(graph, pairs_count, snapshot_name, input_checksum)
+    return result
+
+
+def get_compact_start_node(graph):
+    candidates = np.flatnonzero(graph.out_deg > graph.in_deg)
+    return int(candidates[0]) if len(candidates) > 0 else 0
+
+
+def traverse_compact_graph(graph, start_node):
+    # same walk as traverse_graph: next_edge[v] - 1 is the edge edges[v].pop() would return
+    targets = graph.targets.tolist()
+    first_edge = graph.offsets[:-1].tolist()
+    next_edge = graph.offsets[1:].tolist()
+
+    traverse_stack = [start_node]
+    path = []
+    while len(traverse_stack) > 0:
+        v = traverse_stack[-1]
+        if next_edge[v] > first_edge[v]:
+            next_edge[v] -= 1
+            traverse_stack.append(targets[next_edge[v]])
+        else:
+            path.append(v)
+            traverse_stack.pop()
+    return path[::-1]
+
+
+def report_bytes_per_edge(file_name):
+    nodes, edges, n, k, d = read_graph(file_name)
     in_deg, out_deg = get_degrees(nodes, edges)
-    start_node = get_start_node(nodes, in_deg, out_deg)
-    path = traverse_graph(edges, start_node)
-    genome = assemble_genome(path, d)
+    dict_bytes = deep_getsizeof((nodes, edges, in_deg, out_deg))
+
+    graph, compact_n, _, _ = read_compact_graph(file_name)
+    assert compact_n == n
+    compact_bytes = graph.nbytes()
+
+    print(f'edges: {n}, nodes: {graph.node_count()}')
+    print(f'dict graph: {dict_bytes / n:.1f} bytes per edge')
+    print(f'compact graph: {compact_bytes / n:.1f} bytes per edge')
+    return dict_bytes / n, compact_bytes / n
+
+
+class RollingHash:
+    def __init__(self, text):
+        self.prefix = [0]
+        self.powers = [1]
+        for cur_c in text:
+            self.prefix.append((self.prefix[-1] * HASH_BASE + ord(cur_c)) % HASH_MOD)
+            self.powers.append(self.powers[-1] * HASH_BASE % HASH_MOD)
+
+    def get(self, start, end):
+        assert 0 <= start <= end < len(self.prefix)
+        return (self.prefix[end] - self.prefix[start] * self.powers[end - start]) % HASH_MOD
+
+
+def get_strands(path):
+    first = [path[0][0]]
+    second = [path[0][1]]
+    for kmer_1, kmer_2 in path[1:]:
+        first.append(kmer_1[-1])
+        second.append(kmer_2[-1])
+    return ''.join(first), ''.join(second)
+
+
+def strands_agree(first, second, k, d):
+    # assemble_genome takes first[:k + d] and then the whole second strand, so first[k + d:]
+    # must repeat the start of second
+    assert len(first) == len(second)
+    overlap = len(first) - k - d
+    if overlap <= 0:
+        return True
+    return RollingHash(first).get(k + d, len(first)) == RollingHash(second).get(0, overlap)
+
+
+def __find_consistent_path(start_node, out_edges, get_pair, edges_count, k, d, stats, max_retries):
+    # depth-first search over the Eulerian paths from start_node: every step takes one of the
+    # distinct unused out-edges of the last node, and a step whose first strand character disagrees
+    # with the second strand k + d characters earlier is never taken; a dead end undoes the last
+    # step and tries the next edge there, every undone step counts as a retry
+    unused = {v: list(us) for v, us in out_edges.items()}
+    path = [start_node]
+    first, second = map(list, get_pair(start_node))
+    choices = []
+    while len(path) <= edges_count:
+        v = path[-1]
+        if len(choices) < len(path):
+            # distinct targets, in the order edges[v].pop() would take them
+            choices.append([list(dict.fromkeys(reversed(unused.get(v, [])))), 0])
+        candidates, next_idx = choices[-1]
+
+        advanced = False
+        while next_idx < len(candidates) and not advanced:
+            u = candidates[next_idx]
+            next_idx += 1
+            kmer_1, kmer_2 = get_pair(u)
+            if len(first) >= k + d and kmer_1[-1] != second[len(first) - k - d]:
+                continue
+            unused[v].remove(u)
+            path.append(u)
+            first.append(kmer_1[-1])
+            second.append(kmer_2[-1])
+            advanced = True
+        choices[-1][1] = next_idx
+        if advanced:
+            continue
+
+        choices.pop()
+        if len(path) == 1 or stats['retries'] >= max_retries:
+            return None
+        stats['retries'] += 1
+        u = path.pop()
+        first.pop()
+        second.pop()
+        unused[path[-1]].append(u)
+    return path
+
+
+def __assemble_checked(path, get_pairs, get_search_graph, k, d, max_retries):
+    # the walk traverse_graph takes is kept when both strands agree, otherwise the paths are searched
+    # from its start node, then, if the graph has no unbalanced node to start from, from every other one
+    stats = {'attempts': 1, 'retries': 0}
+    pairs = get_pairs(path)
+    if strands_agree(*get_strands(pairs), k, d):
+        return assemble_genome(pairs, d), stats
+
+    out_edges, get_pair, start_nodes = get_search_graph()
+    edges_count = sum(len(us) for us in out_edges.values())
+    for start_node in start_nodes:
+        stats['attempts'] += 1
+        found = __find_consistent_path(start_node, out_edges, get_pair, edges_count, k, d, stats, max_retries)
+        if found is not None:
+            pairs = get_pairs(found)
+            assert strands_agree(*get_strands(pairs), k, d)
+            return assemble_genome(pairs, d), stats
+        if stats['retries'] >= max_retries:
+            break
+    return None, stats
+
+
+def __get_search_starts(start_node, nodes, in_deg, out_deg):
+    if out_deg[start_node] > in_deg[start_node]:
+        return [start_node]
+    return [start_node] + [v for v in nodes if v != start_node and out_deg[v] > 0]
+
+
+def assemble_genome_checked(edges, start_node, d, max_retries=MAX_ASSEMBLY_RETRIES):
+    # returns the genome, or None if no Eulerian path with agreeing strands was found, and stats
+    k = len(start_node[0]) + 1
+
+    def get_search_graph():
+        nodes = set(edges.keys()) | {u for us in edges.values() for u in us}
+        in_deg, out_deg = get_degrees(nodes, edges)
+        return edges, lambda v: v, __get_search_starts(start_node, sorted(nodes), in_deg, out_deg)
+
+    path = traverse_graph({v: list(us) for v, us in edges.items()}, start_node)
+    return __assemble_checked(path, lambda path: path, get_search_graph, k, d, max_retries)
+
+
+def assemble_compact_genome_checked(graph, start_node, max_retries=MAX_ASSEMBLY_RETRIES):
+    def get_search_graph():
+        targets = graph.targets.tolist()
+        offsets = graph.offsets.tolist()
+        out_edges = {v: targets[offsets[v]:offsets[v + 1]] for v in range(graph.node_count())}
+        all_pairs = graph.get_pairs(range(graph.node_count()))
+        starts = __get_search_starts(start_node, range(graph.node_count()), graph.in_deg, graph.out_deg)
+        return out_edges, all_pairs.__getitem__, starts
+
+    path = traverse_compact_graph(graph, start_node)
+    return __assemble_checked(path, graph.get_pairs, get_search_graph, graph.k, graph.d, max_retries)
+
+
+def condense_graph(graph):
+    # maximal non-branching paths; unitig_of[v] is the unitig that collapsed the 1-in-1-out node v,
+    # -1 for branching nodes, which can end several unitigs
+    if graph.unitigs is not None:
+        return graph.unitigs
+
+    targets = graph.targets.tolist()
+    offsets = graph.offsets.tolist()
+    is_simple = ((graph.in_deg == 1) & (graph.out_deg == 1)).tolist()
+    unitig_of = [-1 for _ in range(graph.node_count())]
+    unitigs = []
+
+    for v in np.flatnonzero(~np.array(is_simple, dtype=bool) & (graph.out_deg > 0)).tolist():
+        for edge_idx in range(offsets[v], offsets[v + 1]):
+            path = [v]
+            u = targets[edge_idx]
+            while is_simple[u]:
+                unitig_of[u] = len(unitigs)
+                path.append(u)
+                u = targets[offsets[u]]
+            path.append(u)
+            unitigs.append(path)
+
+    # whatever 1-in-1-out node is left lies on an isolated cycle
+    for v in range(graph.node_count()):
+        if not is_simple[v] or unitig_of[v] != -1:
+            continue
+        path = [v]
+        unitig_of[v] = len(unitigs)
+        u = targets[offsets[v]]
+        while u != v:
+            unitig_of[u] = len(unitigs)
+            path.append(u)
+            u = targets[offsets[u]]
+        path.append(v)
+        unitigs.append(path)
+
+    graph.unitigs = unitigs
+    graph.unitig_of = np.array(unitig_of, dtype=np.int32)
+    return unitigs
+
+
+def get_node_unitig(graph, v):
+    condense_graph(graph)
+    unitig_idx = int(graph.unitig_of[v])
+    return None if unitig_idx == -1 else graph.unitigs[unitig_idx]
+
+
+def get_paired_contig(graph, path):
+    codes = unpack_codes(graph.keys[np.asarray(path, dtype=np.int64)], 2 * (graph.k - 1))
+    first = np.concatenate((codes[0, :graph.k - 1], codes[1:, graph.k - 2]))
+    second = np.concatenate((codes[0, graph.k - 1:], codes[1:, -1]))
+    return decode_dna(first), decode_dna(second)
+
+
+def get_paired_contigs(graph):
+    return [get_paired_contig(graph, cur_path) for cur_path in condense_graph(graph)]
+
+
+def main(mode='genome'):
+    assert mode in {'genome', 'contigs'}
+    graph, n, k, d = load_or_build_graph("rosalind_ba3j.txt")
+    if mode == 'contigs':
+        for first, second in get_paired_contigs(graph):
+            print(f'{first}|{second}')
+        return
+
+    start_node = get_compact_start_node(graph)
+    genome, stats = assemble_compact_genome_checked(graph, start_node)
+    if genome is None:
+        # print the unchecked walk, as before the check, and say that its strands disagree
+        print(f'no path with agreeing strands found after {stats["retries"]} retries, '
+              f'the genome below is not verified', file=sys.stderr)
+        genome = assemble_genome(graph.get_pairs(traverse_compact_graph(graph, start_node)), d)
     assert len(genome) == 2 * k + d + n - 1
     print(genome)
 
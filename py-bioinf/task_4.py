@@ -1,7 +1,18 @@
 import math
+import random
+import time
+from multiprocessing import Pool
+
+import numpy as np
+
+from memory_usage import deep_getsizeof
 
 GAP_OPEN_PENALTY = -11
 GAP_EXTENSION_PENALTY = -1
+LAYERS = ('M', 'Ix', 'Iy')
+DIRECTION_BITS = 2
+DIRECTION_MASK = 3
+LINEAR_SPACE_THRESHOLD = 1 << 28
 
 
 def check_symmetry(score_matrix, keys):
@@ -37,10 +48,26 @@ def get_strings(file_name):
         return [cur_line.strip() for cur_line in file.readlines()]
 
 
+def pack_directions(M_prev, Ix_prev, Iy_prev):
+    # for every layer, the index in LAYERS of the layer the cell came from, 2 bits per layer
+    return M_prev | (Ix_prev << DIRECTION_BITS) | (Iy_prev << (2 * DIRECTION_BITS))
+
+
+def get_prev(prev, layer, i, j):
+    layer_idx = LAYERS.index(layer)
+    prev_layer = LAYERS[(int(prev[i][j]) >> (layer_idx * DIRECTION_BITS)) & DIRECTION_MASK]
+    if layer == 'M':
+        return prev_layer, i - 1, j - 1
+    elif layer == 'Ix':
+        return prev_layer, i - 1, j
+    else:
+        return prev_layer, i, j - 1
+
+
 def get_d(x, y):
     lx = len(x)
     ly = len(y)
-    prev = {}
+    prev = np.zeros((ly + 1, lx + 1), dtype=np.uint8)
 
     M: list = [[-math.inf for _ in range(lx + 1)] for _ in range(ly + 1)]
     M[0][0] = 0
@@ -49,13 +76,13 @@ def get_d(x, y):
     for i in range(ly + 1):
         Ix[i][0] = i * GAP_EXTENSION_PENALTY + GAP_OPEN_PENALTY
         if i > 0:
-            prev[("Ix", i, 0)] = ("Ix", i - 1, 0)
+            prev[i][0] = pack_directions(0, 1, 0)
 
     Iy: list = [[-math.inf for _ in range(lx + 1)] for _ in range(ly + 1)]
     for j in range(lx + 1):
         Iy[0][j] = j * GAP_EXTENSION_PENALTY + GAP_OPEN_PENALTY
         if j > 0:
-            prev[("Iy", 0, j)] = ("Iy", 0, j - 1)
+            prev[0][j] = pack_directions(0, 0, 2)
 
     return M, Ix, Iy, prev
 
@@ -78,31 +105,33 @@ def calc_d(score_matrix, M, Ix, Iy, x, y, prev):
 
             # M[i][j]
             M[i][j] = M[i - 1][j - 1] + cur_cost
-            prev[("M", i, j)] = ("M", i - 1, j - 1)
+            M_prev = 0
 
             if Ix[i - 1][j - 1] + cur_cost > M[i][j]:
                 M[i][j] = Ix[i - 1][j - 1] + cur_cost
-                prev[("M", i, j)] = ("Ix", i - 1, j - 1)
+                M_prev = 1
 
             if Iy[i - 1][j - 1] + cur_cost > M[i][j]:
                 M[i][j] = Iy[i - 1][j - 1] + cur_cost
-                prev[("M", i, j)] = ("Iy", i - 1, j - 1)
+                M_prev = 2
 
             # Ix[i][j]
             Ix[i][j] = M[i - 1][j] + GAP_OPEN_PENALTY
-            prev[("Ix", i, j)] = ("M", i - 1, j)
+            Ix_prev = 0
 
             if Ix[i - 1][j] + GAP_EXTENSION_PENALTY > Ix[i][j]:
                 Ix[i][j] = Ix[i - 1][j] + GAP_EXTENSION_PENALTY
-                prev[("Ix", i, j)] = ("Ix", i - 1, j)
+                Ix_prev = 1
 
             # Iy[i][j]
             Iy[i][j] = M[i][j - 1] + GAP_OPEN_PENALTY
-            prev[("Iy", i, j)] = ("M", i, j - 1)
+            Iy_prev = 0
 
             if Iy[i][j - 1] + GAP_EXTENSION_PENALTY > Iy[i][j]:
                 Iy[i][j] = Iy[i][j - 1] + GAP_EXTENSION_PENALTY
-                prev[("Iy", i, j)] = ("Iy", i, j - 1)
+                Iy_prev = 2
+
+            prev[i][j] = pack_directions(M_prev, Ix_prev, Iy_prev)
 
 
 def get_starting_point(M, Ix, Iy):
@@ -114,43 +143,535 @@ def get_starting_point(M, Ix, Iy):
         return 'Iy', Iy[-1][-1]
 
 
-def main():
-    score_matrix = read_score_matrix('BLOSUM62.txt')
-    x, y = get_strings('rosalind_ba5j.txt')
-    M, Ix, Iy, prev = get_d(x, y)
-    calc_d(score_matrix, M, Ix, Iy, x, y, prev)
-
+def get_dense_score_matrix(score_matrix):
+    alphabet = sorted({key_a for key_a, _ in score_matrix.keys()})
+    alphabet_index = {c: idx for idx, c in enumerate(alphabet)}
+    dense = np.array([[score_matrix[(key_a, key_b)] for key_b in alphabet] for key_a in alphabet], dtype=np.int64)
+    return alphabet_index, dense
+
+
+def encode_sequence(s, alphabet_index):
+    assert all(c in alphabet_index for c in s)
+    return np.array([alphabet_index[c] for c in s], dtype=np.intp)
+
+
+def get_first_row(lx):
+    M = np.full(lx + 1, -math.inf)
+    M[0] = 0
+    Ix = np.full(lx + 1, -math.inf)
+    Ix[0] = GAP_OPEN_PENALTY
+    Iy = np.arange(lx + 1) * GAP_EXTENSION_PENALTY + GAP_OPEN_PENALTY
+    return M, Ix, Iy.astype(np.float64)
+
+
+def calc_row(prev_M, prev_Ix, prev_Iy, costs, first_Ix, with_directions=True):
+    # one row of all three layers from the previous one, with the same recurrence and tie-breaking
+    # as calc_d; first_Ix is Ix in column 0, the only reachable cell there. Returns the rows and,
+    # per layer, the layer each cell came from (index in LAYERS), or None without with_directions
+    lx = len(costs)
+    M = np.full(lx + 1, -math.inf)
+    Ix = np.empty(lx + 1)
+    Iy = np.full(lx + 1, -math.inf)
+
+    # M[i][j]: argmax keeps the first of M, Ix, Iy on ties, as the strict comparisons in calc_d do
+    candidates = np.stack((prev_M[:-1], prev_Ix[:-1], prev_Iy[:-1]))
+    M[1:] = candidates.max(axis=0) + costs
+
+    # Ix[i][j]
+    Ix[0] = first_Ix
+    opened_Ix = prev_M[1:] + GAP_OPEN_PENALTY
+    extended_Ix = prev_Ix[1:] + GAP_EXTENSION_PENALTY
+    Ix[1:] = np.maximum(opened_Ix, extended_Ix)
+
+    # Iy[i][j] = max(M[i][j - 1] + open, Iy[i][j - 1] + ext) unrolls into a prefix maximum
+    # of M[i][l - 1] + open + (j - l) * ext over l <= j; all values are exact integers in float64
+    opened_Iy = M[:-1] + GAP_OPEN_PENALTY
+    steps = np.arange(1, lx + 1) * GAP_EXTENSION_PENALTY
+    Iy[1:] = np.maximum.accumulate(opened_Iy - steps) + steps
+
+    if not with_directions:
+        return M, Ix, Iy, None
+
+    M_prev = np.zeros(lx + 1, dtype=np.uint8)
+    Ix_prev = np.ones(lx + 1, dtype=np.uint8)
+    Iy_prev = np.full(lx + 1, 2, dtype=np.uint8)
+    M_prev[1:] = candidates.argmax(axis=0)
+    Ix_prev[1:] = extended_Ix > opened_Ix
+    Iy_prev[1:] = np.where(Iy[:-1] + GAP_EXTENSION_PENALTY > opened_Iy, 2, 0)
+    return M, Ix, Iy, (M_prev, Ix_prev, Iy_prev)
+
+
+def calc_d_profile(profile, y_codes, with_directions=True):
+    # profile[c] holds the scores of residue c against every position of x, so row i costs profile[y[i - 1]]
+    lx = profile.shape[1]
+    ly = len(y_codes)
+
+    prev = np.empty((ly + 1, lx + 1), dtype=np.uint8) if with_directions else None
+    M, Ix, Iy = get_first_row(lx)
+    if with_directions:
+        prev[0] = pack_directions(0, 0, 2)  # only Iy is reachable in row 0
+    for i in range(1, ly + 1):
+        first_Ix = i * GAP_EXTENSION_PENALTY + GAP_OPEN_PENALTY
+        M, Ix, Iy, row_directions = calc_row(M, Ix, Iy, profile[y_codes[i - 1]], first_Ix, with_directions)
+        if with_directions:
+            prev[i] = pack_directions(*row_directions)
+
+    last = [M[-1], Ix[-1], Iy[-1]]
+    start_layer = int(np.argmax(last))  # first maximum, as get_starting_point
+    return int(last[start_layer]), start_layer, prev
+
+
+def calc_d_vectorized(score_matrix, x, y):
+    alphabet_index, dense = get_dense_score_matrix(score_matrix)
+    x_codes = encode_sequence(x, alphabet_index)
+    y_codes = encode_sequence(y, alphabet_index)
+    return calc_d_profile(dense[:, x_codes], y_codes)
+
+
+def traceback(prev, x, y, start_layer, row_starts=None):
+    # with row_starts, prev[i] only holds the columns from row_starts[i] on
     res_x = []
     res_y = []
-    cur_d, best_d = get_starting_point(M, Ix, Iy)
+    cur_layer = start_layer
     cur_i, cur_j = len(y), len(x)
     while cur_i > 0 or cur_j > 0:
-        assert (cur_d, cur_i, cur_j) in prev
-        prev_d, prev_i, prev_j = prev[(cur_d, cur_i, cur_j)]
-        assert prev_d in {'M', 'Ix', 'Iy'}
-        assert 0 <= prev_i <= cur_i and 0 <= prev_j <= cur_j and \
-               (prev_i < cur_i or prev_j < cur_j)
-
-        if prev_i == cur_i - 1 and prev_j == cur_j - 1:
+        cur_col = cur_j if row_starts is None else cur_j - row_starts[cur_i]
+        assert cur_col >= 0
+        prev_layer = (int(prev[cur_i][cur_col]) >> (cur_layer * DIRECTION_BITS)) & DIRECTION_MASK
+        if cur_layer == 0:
             res_y.append(y[cur_i - 1])
             res_x.append(x[cur_j - 1])
-        elif prev_i == cur_i:
+            cur_i -= 1
+            cur_j -= 1
+        elif cur_layer == 1:
+            res_y.append(y[cur_i - 1])
+            res_x.append('-')
+            cur_i -= 1
+        else:
             res_y.append('-')
             res_x.append(x[cur_j - 1])
+            cur_j -= 1
+        assert cur_i >= 0 and cur_j >= 0
+        cur_layer = prev_layer
+    return ''.join(res_x[::-1]), ''.join(res_y[::-1])
+
+
+def align_vectorized(score_matrix, x, y):
+    best_d, start_layer, prev = calc_d_vectorized(score_matrix, x, y)
+    res_x, res_y = traceback(prev, x, y, start_layer)
+    return best_d, res_x, res_y
+
+
+def get_origin_row(lx, origin, can_open):
+    # row 0 of a sub-rectangle whose corner cell holds origin (M, Ix, Iy); the corner M may open
+    # a gap only inside the matrix, at the global origin the first gap costs open + ext as in calc_d
+    origin_M, origin_Ix, origin_Iy = origin
+    steps = np.arange(lx + 1) * GAP_EXTENSION_PENALTY
+    M = np.full(lx + 1, -math.inf)
+    M[0] = origin_M
+    Ix = np.full(lx + 1, -math.inf)
+    Ix[0] = origin_Ix
+    Iy = (origin_Iy + steps).astype(np.float64)
+    Iy_prev = np.full(lx + 1, 2, dtype=np.uint8)
+    if can_open and lx > 0:
+        opened = origin_M + GAP_OPEN_PENALTY + steps[:-1]
+        Iy[1:] = np.maximum(Iy[1:], opened)
+        Iy_prev[1] = 2 if origin_Iy + GAP_EXTENSION_PENALTY > origin_M + GAP_OPEN_PENALTY else 0
+    Iy[0] = origin_Iy
+    return M, Ix, Iy, Iy_prev
+
+
+def get_origin_column(ly, origin, can_open):
+    # Ix in column 0 of the same sub-rectangle, with the layer Ix[1][0] came from
+    origin_M, origin_Ix, _ = origin
+    column = (origin_Ix + np.arange(ly + 1) * GAP_EXTENSION_PENALTY).astype(np.float64)
+    first_prev = 1
+    if can_open and ly > 0 and origin_M + GAP_OPEN_PENALTY >= origin_Ix + GAP_EXTENSION_PENALTY:
+        column[1:] = origin_M + GAP_OPEN_PENALTY + np.arange(ly) * GAP_EXTENSION_PENALTY
+        first_prev = 0
+    return column, first_prev
+
+
+def calc_last_row(dense, x_codes, y_codes, origin, can_open):
+    # forward scores of the last row of the sub-rectangle, keeping two rows at a time
+    M, Ix, Iy, _ = get_origin_row(len(x_codes), origin, can_open)
+    column, _ = get_origin_column(len(y_codes), origin, can_open)
+    for i in range(1, len(y_codes) + 1):
+        M, Ix, Iy, _ = calc_row(M, Ix, Iy, dense[y_codes[i - 1], x_codes], column[i], with_directions=False)
+    return M, Ix, Iy
+
+
+def calc_first_row_backward(dense, x_codes, y_codes, end):
+    # best score from every cell of row 0 in every layer to the far corner of the sub-rectangle,
+    # entering it in a layer allowed by end (0 for allowed, -inf otherwise)
+    lx = len(x_codes)
+    end_M, end_Ix, end_Iy = end
+    steps = np.arange(lx + 1) * GAP_EXTENSION_PENALTY
+    next_M = next_Ix = None
+    for i in range(len(y_codes), -1, -1):
+        diagonal = np.full(lx + 1, -math.inf)
+        down = np.full(lx + 1, -math.inf)
+        if next_M is not None:
+            diagonal[:-1] = next_M[1:] + dense[y_codes[i], x_codes]
+            down = next_Ix
+        last = i == len(y_codes)
+
+        # Iy[i][j] = max(diagonal[j], Iy[i][j + 1] + ext) unrolls into a suffix maximum
+        reachable = diagonal.copy()
+        if last:
+            reachable[-1] = end_Iy
+        Iy = np.maximum.accumulate((reachable + steps)[::-1])[::-1] - steps
+        Ix = np.maximum(diagonal, down + GAP_EXTENSION_PENALTY)
+        M = np.maximum(diagonal, down + GAP_OPEN_PENALTY)
+        M[:-1] = np.maximum(M[:-1], Iy[1:] + GAP_OPEN_PENALTY)
+        if last:
+            M[-1] = max(M[-1], end_M)
+            Ix[-1] = max(Ix[-1], end_Ix)
+        next_M, next_Ix = M, Ix
+    return next_M, next_Ix, Iy
+
+
+def __align_small(dense, x_codes, y_codes, origin, can_open, end):
+    # full traceback over a sub-rectangle with at most one row of cells below row 0
+    lx = len(x_codes)
+    ly = len(y_codes)
+    prev = np.empty((ly + 1, lx + 1), dtype=np.uint8)
+    M, Ix, Iy, Iy_prev = get_origin_row(lx, origin, can_open)
+    prev[0] = pack_directions(0, 0, Iy_prev)
+    column, first_prev = get_origin_column(ly, origin, can_open)
+    for i in range(1, ly + 1):
+        M, Ix, Iy, row_directions = calc_row(M, Ix, Iy, dense[y_codes[i - 1], x_codes], column[i])
+        row_directions[1][0] = first_prev if i == 1 else 1
+        prev[i] = pack_directions(*row_directions)
+
+    last = np.array([M[-1], Ix[-1], Iy[-1]]) + end
+    cur_layer = int(np.argmax(last))
+    path = []
+    cur_i, cur_j = ly, lx
+    while cur_i > 0 or cur_j > 0:
+        path.append(cur_layer)
+        prev_layer = (int(prev[cur_i][cur_j]) >> (cur_layer * DIRECTION_BITS)) & DIRECTION_MASK
+        if cur_layer != 2:
+            cur_i -= 1
+        if cur_layer != 1:
+            cur_j -= 1
+        assert cur_i >= 0 and cur_j >= 0
+        cur_layer = prev_layer
+    return path[::-1]
+
+
+def __align_linear(dense, x_codes, y_codes, origin, can_open, end):
+    # Myers-Miller: split the rows in half, find the cell and layer of the middle row an optimal
+    # path passes through from forward and backward scores, and solve both halves the same way
+    ly = len(y_codes)
+    if ly <= 1:
+        return __align_small(dense, x_codes, y_codes, origin, can_open, end)
+
+    mid = ly // 2
+    forward = calc_last_row(dense, x_codes, y_codes[:mid], origin, can_open)
+    backward = calc_first_row_backward(dense, x_codes, y_codes[mid:], end)
+    total = np.stack(forward) + np.stack(backward)
+    mid_layer, mid_j = np.unravel_index(int(np.argmax(total)), total.shape)
+
+    mid_state = np.full(len(LAYERS), -math.inf)
+    mid_state[mid_layer] = 0
+    return __align_linear(dense, x_codes[:mid_j], y_codes[:mid], origin, can_open, mid_state) + \
+        __align_linear(dense, x_codes[mid_j:], y_codes[mid:], mid_state, True, end)
+
+
+def align_linear(score_matrix, x, y):
+    # same optimal score as align_vectorized in O(len(x)) memory, about twice the work
+    alphabet_index, dense = get_dense_score_matrix(score_matrix)
+    x_codes = encode_sequence(x, alphabet_index)
+    y_codes = encode_sequence(y, alphabet_index)
+    origin = (0, GAP_OPEN_PENALTY, GAP_OPEN_PENALTY)
+    path = __align_linear(dense, x_codes, y_codes, origin, False, np.zeros(len(LAYERS)))
+
+    res_x = []
+    res_y = []
+    best_d = 0
+    cur_i, cur_j = 0, 0
+    prev_layer = None
+    for cur_layer in path:
+        if cur_layer == 0:
+            best_d += dense[y_codes[cur_i], x_codes[cur_j]]
+        elif prev_layer == cur_layer:
+            best_d += GAP_EXTENSION_PENALTY
         else:
-            res_y.append(y[cur_i - 1])
-            res_x.append('-')
+            best_d += GAP_OPEN_PENALTY
+            if prev_layer is None:
+                best_d += GAP_EXTENSION_PENALTY  # leading gaps start from Ix[0][0] = Iy[0][0] = open
+        res_x.append('-' if cur_layer == 1 else x[cur_j])
+        res_y.append('-' if cur_layer == 2 else y[cur_i])
+        cur_i += cur_layer != 2
+        cur_j += cur_layer != 1
+        prev_layer = cur_layer
+    return int(best_d), ''.join(res_x), ''.join(res_y)
+
+
+def align(score_matrix, x, y, linear_threshold=LINEAR_SPACE_THRESHOLD):
+    # the full traceback takes a byte per cell; past linear_threshold cells switch to linear space
+    if (len(x) + 1) * (len(y) + 1) > linear_threshold:
+        return align_linear(score_matrix, x, y)
+    return align_vectorized(score_matrix, x, y)
+
+
+def shift_row(row, row_start, start, width):
+    # the columns start .. start + width - 1 of a row that holds the columns from row_start on
+    result = np.full(width, -math.inf)
+    lo = max(start, row_start)
+    hi = min(start + width, row_start + len(row))
+    if lo < hi:
+        result[lo - start:hi - start] = row[lo - row_start:hi - row_start]
+    return result
 
-        cur_i = prev_i
-        cur_j = prev_j
-        cur_d = prev_d
 
-    res_x = res_x[::-1]
-    res_y = res_y[::-1]
+def calc_row_range(prev_rows, prev_start, costs, i, start, end):
+    # row i of all three layers for the columns start .. end only, from a previous row that holds
+    # the columns from prev_start on; every cell outside the computed ranges is unreachable
+    from_col = max(start - 1, 0)
+    width = end - from_col + 1
+    prev_M, prev_Ix, prev_Iy = (shift_row(cur_row, prev_start, from_col, width) for cur_row in prev_rows)
+    first_Ix = i * GAP_EXTENSION_PENALTY + GAP_OPEN_PENALTY if start == 0 else -math.inf
+    M, Ix, Iy, row_directions = calc_row(prev_M, prev_Ix, prev_Iy, costs[from_col:end], first_Ix)
+    skip = start - from_col
+    return (M[skip:], Ix[skip:], Iy[skip:]), pack_directions(*(cur_dir[skip:] for cur_dir in row_directions))
+
+
+def __traceback_ranges(rows, prev, row_starts, x, y):
+    last_start = row_starts[-1]
+    if last_start + len(rows[0]) <= len(x):
+        return None, None, None
+    last = [cur_row[len(x) - last_start] for cur_row in rows]
+    start_layer = int(np.argmax(last))
+    if last[start_layer] == -math.inf:
+        return None, None, None
+    res_x, res_y = traceback(prev, x, y, start_layer, row_starts)
+    return int(last[start_layer]), res_x, res_y
+
+
+def get_best_match_scores(dense, x_codes, y_codes):
+    # the best score every residue of x can get against some residue of y, and the other way round;
+    # with an empty sequence nothing is matched at all
+    if len(x_codes) == 0 or len(y_codes) == 0:
+        return np.zeros(len(x_codes), dtype=np.int64), np.zeros(len(y_codes), dtype=np.int64)
+    best_x = dense[np.ix_(x_codes, np.unique(y_codes))].max(axis=1)
+    best_y = dense[np.ix_(y_codes, np.unique(x_codes))].max(axis=1)
+    return best_x, best_y
+
+
+def get_top_sums(best_scores):
+    # result[m] bounds the score of any m matches of the sequence
+    return np.concatenate(([0], np.cumsum(np.sort(best_scores)[::-1])))
+
+
+def get_suffix_sums(best_scores):
+    # result[j] bounds the score of all matches of the sequence from position j on
+    return np.concatenate((np.cumsum(np.maximum(best_scores, 0)[::-1])[::-1], [0]))
+
+
+def align_banded(score_matrix, x, y, band_width):
+    # only the cells with -band_width <= (j - i) - shift <= band_width are filled, for a shift between
+    # 0 and len(x) - len(y), so the band always holds both corners. Returns the score, the alignment
+    # and whether it is guaranteed optimal: the band score beats every path that leaves the band
+    alphabet_index, dense = get_dense_score_matrix(score_matrix)
+    x_codes = encode_sequence(x, alphabet_index)
+    y_codes = encode_sequence(y, alphabet_index)
+    profile = dense[:, x_codes]
+    lx = len(x)
+    ly = len(y)
+    min_diag = min(0, lx - ly) - band_width
+    max_diag = max(0, lx - ly) + band_width
+
+    end = min(lx, max_diag)
+    rows = tuple(cur_row[:end + 1] for cur_row in get_first_row(lx))
+    prev = [pack_directions(0, 0, np.full(end + 1, 2, dtype=np.uint8))]
+    row_starts = [0]
+    for i in range(1, ly + 1):
+        start = max(0, i + min_diag)
+        end = min(lx, i + max_diag)
+        rows, directions = calc_row_range(rows, row_starts[-1], profile[y_codes[i - 1]], i, start, end)
+        prev.append(directions)
+        row_starts.append(start)
+    best_d, res_x, res_y = __traceback_ranges(rows, prev, row_starts, x, y)
+
+    # a path that reaches diagonal max_diag + 1 has at least that many Iy gaps and as many Ix gaps
+    # as it needs to come back, so at least min_gaps gaps and (lx + ly - gaps) / 2 matches
+    best_x, best_y = get_best_match_scores(dense, x_codes, y_codes)
+    top_x = get_top_sums(best_x)
+    top_y = get_top_sums(best_y)
+    outside_bound = -math.inf
+    for min_gaps, reachable in ((2 * (max_diag + 1) - (lx - ly), max_diag + 1 <= lx),
+                                ((lx - ly) - 2 * (min_diag - 1), min_diag - 1 >= -ly)):
+        if reachable:
+            gaps = np.arange(min_gaps, lx + ly + 1, 2)
+            matches = (lx + ly - gaps) // 2
+            bound = np.minimum(top_x[matches], top_y[matches]) + GAP_OPEN_PENALTY + (gaps - 1) * GAP_EXTENSION_PENALTY
+            outside_bound = max(outside_bound, bound.max())
+    return best_d, res_x, res_y, bool(best_d is not None and best_d >= outside_bound)
+
+
+def align_x_drop(score_matrix, x, y, x_drop):
+    # each row is filled only from the first to the last column of the previous row that scored no
+    # less than the best score so far minus x_drop, cells under that are dropped. Returns the score
+    # (None if the last cell was dropped), the alignment and whether it is guaranteed optimal: it beats
+    # the score of every dropped cell plus a bound on what any path could still gain from there
+    alphabet_index, dense = get_dense_score_matrix(score_matrix)
+    x_codes = encode_sequence(x, alphabet_index)
+    y_codes = encode_sequence(y, alphabet_index)
+    profile = dense[:, x_codes]
+    lx = len(x)
+    ly = len(y)
+    best_x, best_y = get_best_match_scores(dense, x_codes, y_codes)
+    suffix_x = get_suffix_sums(best_x)
+    suffix_y = get_suffix_sums(best_y)
+    # past the last kept column a row can only go on through Iy, which loses ext per column
+    reach = x_drop // -GAP_EXTENSION_PENALTY + 1
+
+    rows = tuple(cur_row[:min(lx, reach) + 1] for cur_row in get_first_row(lx))
+    prev = [pack_directions(0, 0, np.full(len(rows[0]), 2, dtype=np.uint8))]
+    row_starts = [0]
+    best_so_far = -math.inf
+    dropped_bound = -math.inf
+    for i in range(ly + 1):
+        if i > 0:
+            rows, directions = calc_row_range(rows, row_starts[-1], profile[y_codes[i - 1]], i, start, end)
+            prev.append(directions)
+            row_starts.append(start)
+
+        cur_best = np.maximum.reduce(rows)
+        best_so_far = max(best_so_far, cur_best.max())
+        kept = cur_best >= best_so_far - x_drop
+        dropped = ~kept & (cur_best > -math.inf)
+        if np.any(dropped):
+            cols = row_starts[-1] + np.flatnonzero(dropped)
+            # the rest of the path matches each remaining residue at most once and needs a gap
+            # extension for every column or row one sequence has left over the other
+            suffix_bound = np.minimum(suffix_x[cols], suffix_y[i]) + \
+                           np.abs((lx - cols) - (ly - i)) * GAP_EXTENSION_PENALTY
+            bound = cur_best[dropped] + suffix_bound
+            dropped_bound = max(dropped_bound, bound.max())
+        if not np.any(kept):
+            return None, None, None, False
+
+        kept_cols = np.flatnonzero(kept)
+        first, last = int(kept_cols[0]), int(kept_cols[-1])
+        rows = tuple(np.where(kept, cur_row, -math.inf)[first:last + 1] for cur_row in rows)
+        prev[-1] = prev[-1][first:]
+        row_starts[-1] += first
+        start = row_starts[-1]
+        end = min(lx, start + (last - first) + 1 + reach)
+
+    best_d, res_x, res_y = __traceback_ranges(rows, prev, row_starts, x, y)
+    return best_d, res_x, res_y, bool(best_d is not None and best_d >= dropped_bound)
+
+
+class QueryProfile:
+    # the query is encoded and its score table built once, then aligned as x against many targets
+    def __init__(self, score_matrix, query):
+        self.query = query
+        self.alphabet_index, dense = get_dense_score_matrix(score_matrix)
+        self.profile = dense[:, encode_sequence(query, self.alphabet_index)]
+
+    def score(self, target):
+        y_codes = encode_sequence(target, self.alphabet_index)
+        return calc_d_profile(self.profile, y_codes, with_directions=False)[0]
+
+    def align(self, target):
+        y_codes = encode_sequence(target, self.alphabet_index)
+        best_d, start_layer, prev = calc_d_profile(self.profile, y_codes)
+        res_x, res_y = traceback(prev, self.query, target, start_layer)
+        return best_d, res_x, res_y
+
+
+__worker_profile = None
+
+
+def __init_batch_worker(score_matrix, query, score_only):
+    global __worker_profile
+    __worker_profile = (QueryProfile(score_matrix, query), score_only)
+
+
+def __align_target(task):
+    target_idx, target = task
+    query_profile, score_only = __worker_profile
+    if score_only:
+        return target_idx, len(target), query_profile.score(target)
+    return target_idx, len(target), query_profile.align(target)
+
+
+def align_batch(score_matrix, query, targets, score_only=True, workers=None, chunk_size=16, stats=None):
+    # yields (target index, score) or (target index, (score, res_x, res_y)) in completion order;
+    # stats, if given, collects the number of cells filled and the seconds spent
+    start_time = time.perf_counter()
+    if stats is not None:
+        stats['cells'] = 0
+
+    if workers == 1:
+        __init_batch_worker(score_matrix, query, score_only)
+        results = map(__align_target, enumerate(targets))
+        pool = None
+    else:
+        pool = Pool(processes=workers, initializer=__init_batch_worker, initargs=(score_matrix, query, score_only))
+        results = pool.imap_unordered(__align_target, enumerate(targets), chunksize=chunk_size)
+
+    try:
+        for target_idx, target_len, cur_result in results:
+            if stats is not None:
+                stats['cells'] += len(query) * target_len
+            yield target_idx, cur_result
+    finally:
+        if stats is not None:
+            stats['seconds'] = time.perf_counter() - start_time
+        if pool is not None:
+            pool.terminate()
+
+
+def benchmark_batch(score_matrix, query_len=300, targets=1000, target_len=300, workers=None, seed=0):
+    rng = random.Random(seed)
+    alphabet = sorted({key_a for key_a, _ in score_matrix.keys()})
+    query = ''.join(rng.choice(alphabet) for _ in range(query_len))
+    all_targets = [''.join(rng.choice(alphabet) for _ in range(target_len)) for _ in range(targets)]
+    print('mode\tworkers\tcells\tseconds\tCUPS')
+
+    for score_only in (True, False):
+        for cur_workers in (1, workers):
+            stats = {}
+            for _ in align_batch(score_matrix, query, all_targets, score_only, cur_workers, stats=stats):
+                pass
+            mode = 'score' if score_only else 'traceback'
+            print(f'{mode}\t{cur_workers}\t{stats["cells"]}\t{stats["seconds"]:.2f}\t'
+                  f'{stats["cells"] / stats["seconds"]:.3g}')
+
+
+def measure_traceback_memory(score_matrix, x, y):
+    _, _, prev = calc_d_vectorized(score_matrix, x, y)
+    cells = (len(x) + 1) * (len(y) + 1)
+
+    # the dict calc_d used to fill: ("M", i, j) -> ("Ix", i - 1, j - 1) for every recorded cell
+    dict_prev = {}
+    for i in range(len(y) + 1):
+        for j in range(len(x) + 1):
+            for layer in LAYERS:
+                if (i > 0 and j > 0) or (layer == 'Ix' and i > 0) or (layer == 'Iy' and j > 0):
+                    dict_prev[(layer, i, j)] = get_prev(prev, layer, i, j)
+    dict_bytes = deep_getsizeof(dict_prev)
+
+    print(f'cells: {cells}')
+    print(f'dict traceback: {dict_bytes / cells:.1f} bytes per cell')
+    print(f'packed traceback: {prev.nbytes / cells:.1f} bytes per cell')
+    return dict_bytes / cells, prev.nbytes / cells
+
+
+def main():
+    score_matrix = read_score_matrix('BLOSUM62.txt')
+    x, y = get_strings('rosalind_ba5j.txt')
+    # align picks the NumPy engine and switches to linear space past LINEAR_SPACE_THRESHOLD cells
+    best_d, res_x, res_y = align(score_matrix, x, y)
 
     print(best_d)
-    print(''.join(res_x))
-    print(''.join(res_y))
+    print(res_x)
+    print(res_y)
 
 
 if __name__ == '__main__':
@@ -1,3 +1,13 @@
+import random
+import sys
+import time
+from multiprocessing import Pool
+
+import numpy as np
+
+SCENARIO_MODES = ('text', 'diff', 'checkpoint')
+
+
 def get_lines(file_name):
     with open(file_name, 'r') as file:
         return [cur_line.strip() for cur_line in file.readlines()]
@@ -17,6 +27,44 @@ def parse(line: str):
     return result
 
 
+class FlatGenome:
+    # all blocks of a genome in one array, chromosome i is blocks[offsets[i]:offsets[i + 1]]
+    def __init__(self, blocks, offsets):
+        assert offsets[0] == 0 and offsets[-1] == len(blocks)
+        self.blocks = blocks
+        self.offsets = offsets
+
+    @classmethod
+    def from_chromosomes(cls, genome):
+        lengths = [len(cur_chromosome) for cur_chromosome in genome]
+        blocks = np.array([cur_block for cur_chromosome in genome for cur_block in cur_chromosome], dtype=np.int32)
+        return cls(blocks, np.concatenate(([0], np.cumsum(lengths, dtype=np.int64))))
+
+    def chromosomes_count(self):
+        return len(self.offsets) - 1
+
+    def to_chromosomes(self):
+        return [
+            self.blocks[cur_start:cur_end].tolist()
+            for cur_start, cur_end in zip(self.offsets[:-1], self.offsets[1:])
+        ]
+
+
+def parse_flat(line: str):
+    # the same format as parse in one pass of numpy's number reader: blocks are never 0, so every
+    # closing bracket becomes a 0 that marks the end of a chromosome
+    buffer = np.frombuffer(line.encode('ascii'), dtype=np.uint8)
+    opens = np.flatnonzero(buffer == ord('('))
+    closes = np.flatnonzero(buffer == ord(')'))
+    assert len(opens) == len(closes) and np.all(opens < closes) and np.all(closes[:-1] < opens[1:])
+
+    values = np.fromstring(line.replace('(', ' ').replace(')', ' 0 '), dtype=np.int32, sep=' ')
+    ends = np.flatnonzero(values == 0)
+    assert len(ends) == len(closes)
+    offsets = np.concatenate(([0], ends - np.arange(len(ends))))
+    return FlatGenome(values[values != 0], offsets.astype(np.int64))
+
+
 def chromosome_to_cycle(chromosome):
     result = []
     for x in chromosome:
@@ -33,34 +81,77 @@ def chromosome_to_cycle(chromosome):
     return result
 
 
+class VisitedMarks:
+    # a node is visited if its stamp equals the current generation, so clearing all marks is O(1)
+    def __init__(self, size):
+        self.stamps = [0] * size
+        self.generation = 1
+
+    def clear(self):
+        self.generation += 1
+
+    def visit(self, node):
+        self.stamps[node] = self.generation
+
+    def is_visited(self, node):
+        return self.stamps[node] == self.generation
+
+
+def flat_genome_to_cycle(genome: FlatGenome):
+    # node_from and node_to of every block as in chromosome_to_cycle; the edge after a block leads
+    # to the next block of its chromosome, or back to the first one after the last
+    blocks = genome.blocks.astype(np.int64)
+    node_from = np.where(blocks > 0, 2 * blocks - 1, -2 * blocks)
+    node_to = np.where(blocks > 0, 2 * blocks, -2 * blocks - 1)
+    next_block = np.arange(1, len(blocks) + 1)
+    chromosome_starts = genome.offsets[:-1]
+    chromosome_ends = genome.offsets[1:]
+    assert np.all(chromosome_starts < chromosome_ends)
+    next_block[chromosome_ends - 1] = chromosome_starts
+
+    result = np.zeros(2 * len(blocks) + 1, dtype=np.int64)
+    result[node_to] = node_from[next_block]
+    result[node_from[next_block]] = node_to
+    assert np.all(np.bincount(np.concatenate((node_from, node_to)), minlength=len(result))[1:] == 1)
+    return result.tolist()
+
+
 def genome_to_cycle(genome):
-    result = {}
+    # colored edges as a list indexed by node 1 .. 2n, result[v] is the other end of the edge at v
+    if isinstance(genome, FlatGenome):
+        return flat_genome_to_cycle(genome)
+
+    blocks_count = sum(len(cur_chromosome) for cur_chromosome in genome)
+    result = [0] * (2 * blocks_count + 1)
     for cur_chromosome in genome:
         cur_cycle = chromosome_to_cycle(cur_chromosome)
         assert len(cur_cycle) >= 2 and len(cur_cycle) % 2 == 0
 
         v = cur_cycle[0]
         u = cur_cycle[-1]
-        assert v not in result and u not in result
+        assert result[v] == 0 and result[u] == 0
         result[v] = u
         result[u] = v
 
         for i in range(len(cur_cycle) // 2 - 1):
             v = cur_cycle[2 * i + 1]
             u = cur_cycle[2 * i + 2]
-            assert v not in result and u not in result
+            assert result[v] == 0 and result[u] == 0
             result[v] = u
             result[u] = v
 
+    assert all(result[1:])
     return result
 
 
-def cycle_to_genome(cycles: dict, not_visited: set, start_node):
+def cycle_to_genome(cycles: list, visited: VisitedMarks, start_node):
+    stamps = visited.stamps
+    generation = visited.generation
     cur_node = start_node
     result = []
 
     while True:
-        assert cur_node not in not_visited
+        assert stamps[cur_node] == generation
 
         if cur_node % 2 == 0:
             other_node = cur_node - 1
@@ -70,54 +161,54 @@ def cycle_to_genome(cycles: dict, not_visited: set, start_node):
             cur_gene = other_node // 2
 
         result.append(cur_gene)
-        assert other_node in not_visited
-        not_visited.remove(other_node)
+        assert stamps[other_node] != generation
+        stamps[other_node] = generation
 
-        assert other_node in cycles
         new_node = cycles[other_node]
-        if new_node in not_visited:
-            not_visited.remove(new_node)
+        if stamps[new_node] != generation:
+            stamps[new_node] = generation
             cur_node = new_node
         else:
             return result
 
 
-def cycles_to_genome(cycles: dict):
-    not_visited = {
-        node for node in cycles.keys()
-    }
+def cycles_to_genome(cycles: list, visited: VisitedMarks = None):
+    if visited is None:
+        visited = VisitedMarks(len(cycles))
+    visited.clear()
     result = []
-    while len(not_visited) > 0:
-        start_node = not_visited.pop()
-        cur_chromosome = cycle_to_genome(cycles, not_visited, start_node)
+    for start_node in range(1, len(cycles)):
+        if visited.is_visited(start_node):
+            continue
+        visited.visit(start_node)
+        cur_chromosome = cycle_to_genome(cycles, visited, start_node)
         result.append(cur_chromosome)
     return result
 
 
-def modify_cur_cycles(cur_cycles: dict, final_cycles: dict):
-    assert cur_cycles.keys() == final_cycles.keys()
-    not_visited = {
-        node for node in cur_cycles.keys()
-    }
-    while len(not_visited) > 0:
-        a = not_visited.pop()
+def modify_cur_cycles(cur_cycles: list, final_cycles: list, visited: VisitedMarks = None):
+    assert len(cur_cycles) == len(final_cycles)
+    if visited is None:
+        visited = VisitedMarks(len(cur_cycles))
+    visited.clear()
+    for a in range(1, len(cur_cycles)):
+        if visited.is_visited(a):
+            continue
+        visited.visit(a)
 
-        assert a in cur_cycles
         b = cur_cycles[a]
-        assert b in not_visited
-        not_visited.remove(b)
+        assert not visited.is_visited(b)
+        visited.visit(b)
 
-        assert b in final_cycles
         c = final_cycles[b]
-        if c not in not_visited:
+        if visited.is_visited(c):
             assert c == a
             continue
-        not_visited.remove(c)
+        visited.visit(c)
 
-        assert c in cur_cycles
         d = cur_cycles[c]
-        assert d in not_visited
-        not_visited.remove(d)
+        assert not visited.is_visited(d)
+        visited.visit(d)
 
         assert cur_cycles[a] == b and cur_cycles[b] == a and \
                cur_cycles[c] == d and cur_cycles[d] == c
@@ -132,6 +223,112 @@ def modify_cur_cycles(cur_cycles: dict, final_cycles: dict):
     return False
 
 
+class TwoBreakSorter:
+    # applies the same 2-breaks as repeated modify_cur_cycles calls in O(1) each: the worklist holds
+    # every node in ascending order, a node that is no longer on a non-trivial red-blue cycle is
+    # dropped, and a node whose cycle was only shortened by a 2-break is pushed back
+    def __init__(self, cur_cycles: list, final_cycles: list):
+        assert len(cur_cycles) == len(final_cycles)
+        self.cur_cycles = cur_cycles
+        self.final_cycles = final_cycles
+        self.worklist = list(range(len(cur_cycles) - 1, 0, -1))
+        self.steps = 0
+
+    def apply_next(self):
+        # returns the rewired nodes a, b, c, d: edges (a, b) and (c, d) become (b, c) and (a, d)
+        cur_cycles = self.cur_cycles
+        while len(self.worklist) > 0:
+            a = self.worklist.pop()
+            b = cur_cycles[a]
+            c = self.final_cycles[b]
+            if c == a:
+                continue
+            d = cur_cycles[c]
+            assert cur_cycles[b] == a and cur_cycles[d] == c
+
+            cur_cycles[b] = c
+            cur_cycles[c] = b
+
+            cur_cycles[a] = d
+            cur_cycles[d] = a
+            self.worklist.append(a)
+            self.steps += 1
+            return a, b, c, d
+        return None
+
+    def sort(self):
+        while self.apply_next() is not None:
+            pass
+        return self.steps
+
+
+def count_alternating_cycles(cur_cycles: list, final_cycles: list, visited: VisitedMarks = None):
+    # every node is on exactly one cycle alternating between the edges of both genomes
+    assert len(cur_cycles) == len(final_cycles)
+    if visited is None:
+        visited = VisitedMarks(len(cur_cycles))
+    visited.clear()
+    stamps = visited.stamps
+    generation = visited.generation
+    result = 0
+    for start_node in range(1, len(cur_cycles)):
+        if stamps[start_node] == generation:
+            continue
+        result += 1
+        cur_node = start_node
+        while stamps[cur_node] != generation:
+            other_node = cur_cycles[cur_node]
+            stamps[cur_node] = generation
+            stamps[other_node] = generation
+            cur_node = final_cycles[other_node]
+    return result
+
+
+def two_break_distance(cur_cycles: list, final_cycles: list, visited: VisitedMarks = None):
+    blocks_count = (len(cur_cycles) - 1) // 2
+    return blocks_count - count_alternating_cycles(cur_cycles, final_cycles, visited)
+
+
+__worker_cycles = None
+
+
+def __init_distance_worker(genomes):
+    global __worker_cycles
+    all_cycles = [genome_to_cycle(cur_genome) for cur_genome in genomes]
+    __worker_cycles = (all_cycles, VisitedMarks(len(all_cycles[0])))
+
+
+def __get_pair_distance(pair):
+    i, j = pair
+    all_cycles, visited = __worker_cycles
+    return i, j, two_break_distance(all_cycles[i], all_cycles[j], visited)
+
+
+def get_distance_matrix(genomes, workers=None, chunk_size=64):
+    # 2-break distances between all pairs of genomes over the same blocks; every worker builds
+    # the edges of every genome once and then takes pairs as they come
+    genomes = list(genomes)
+    result = [[0] * len(genomes) for _ in range(len(genomes))]
+    pairs = ((i, j) for i in range(len(genomes)) for j in range(i + 1, len(genomes)))
+
+    if workers == 1:
+        __init_distance_worker(genomes)
+        distances = map(__get_pair_distance, pairs)
+        pool = None
+    else:
+        pool = Pool(processes=workers, initializer=__init_distance_worker, initargs=(genomes,))
+        distances = pool.imap_unordered(__get_pair_distance, pairs, chunksize=chunk_size)
+
+    try:
+        for i, j, cur_distance in distances:
+            result[i][j] = cur_distance
+            result[j][i] = cur_distance
+    finally:
+        if pool is not None:
+            pool.terminate()
+    return result
+
+
 def block_to_string(block):
     assert block != 0
     if block < 0:
@@ -140,7 +337,39 @@ def block_to_string(block):
         return f'+{block}'
 
 
+def flat_genome_to_string(genome: FlatGenome):
+    # every block is written as its sign, its digits and a separator: a space inside a chromosome,
+    # ')(' between chromosomes and ')' after the last one
+    blocks = genome.blocks.astype(np.int64)
+    assert len(blocks) > 0 and np.all(blocks != 0)
+    chromosome_ends = genome.offsets[1:] - 1
+    assert np.all(np.diff(genome.offsets) > 0)
+
+    abs_blocks = np.abs(blocks)
+    digits_count = 1 + np.searchsorted(10 ** np.arange(1, 19, dtype=np.int64), abs_blocks, side='right')
+    separators_len = np.ones(len(blocks), dtype=np.int64)
+    separators_len[chromosome_ends[:-1]] = 2
+    token_ends = 1 + np.cumsum(1 + digits_count + separators_len)
+
+    result = np.full(token_ends[-1], ord(' '), dtype=np.uint8)
+    result[0] = ord('(')
+    token_starts = token_ends - (1 + digits_count + separators_len)
+    result[token_starts] = np.where(blocks > 0, ord('+'), ord('-'))
+    last_digits = token_starts + digits_count
+    rest = abs_blocks
+    for cur_power in range(int(digits_count.max())):
+        has_digit = digits_count > cur_power
+        result[last_digits[has_digit] - cur_power] = ord('0') + rest[has_digit] % 10
+        rest = rest // 10
+    result[last_digits[chromosome_ends] + 1] = ord(')')
+    result[last_digits[chromosome_ends[:-1]] + 2] = ord('(')
+    return result.tobytes().decode('ascii')
+
+
 def genome_to_string(genome):
+    if isinstance(genome, FlatGenome):
+        return flat_genome_to_string(genome)
+
     chromosome_strings = []
     for cur_chromosome in genome:
         cur_str = '(' + ' '.join(map(block_to_string, cur_chromosome)) + ')'
@@ -148,19 +377,128 @@ def genome_to_string(genome):
     return ''.join(chromosome_strings)
 
 
-def main():
+def apply_two_break(cycles: list, a, b, c, d):
+    assert cycles[a] == b and cycles[c] == d
+    cycles[b] = c
+    cycles[c] = b
+    cycles[a] = d
+    cycles[d] = a
+
+
+class ScenarioWriter:
+    # writes a 2-break scenario step by step: 'text' writes the whole genome after every step,
+    # 'diff' writes the step in rosalind 2-break notation (edges (a, b) and (d, c) become (a, d) and
+    # (b, c)), 'checkpoint' writes diffs and the whole genome every checkpoint_every steps. In
+    # 'checkpoint' mode only the latest checkpoint and the diffs since it are kept, so any step
+    # after the latest checkpoint can be materialized; earlier ones are in the written stream
+    def __init__(self, file, start_cycles: list, mode='text', checkpoint_every=1000):
+        assert mode in SCENARIO_MODES
+        self.file = file
+        self.mode = mode
+        self.checkpoint_every = checkpoint_every
+        self.visited = VisitedMarks(len(start_cycles))
+        self.steps = 0
+        self.checkpoint_step = 0
+        self.checkpoint = list(start_cycles) if mode == 'checkpoint' else None
+        self.diffs = []
+
+    def write_step(self, cur_cycles: list, two_break):
+        a, b, c, d = two_break
+        self.steps += 1
+        if self.mode == 'text':
+            self.file.write(genome_to_string(cycles_to_genome(cur_cycles, self.visited)) + '\n')
+            return
+
+        self.file.write(f'{a}, {b}, {d}, {c}\n')
+        if self.mode != 'checkpoint':
+            return
+
+        if self.steps - self.checkpoint_step < self.checkpoint_every:
+            self.diffs.append(two_break)
+            return
+
+        # overwrite the previous checkpoint in place, its diffs are no longer needed
+        self.checkpoint[:] = cur_cycles
+        self.checkpoint_step = self.steps
+        self.diffs.clear()
+        self.file.write(genome_to_string(cycles_to_genome(cur_cycles, self.visited)) + '\n')
+
+    def materialize(self, step=None):
+        assert self.mode == 'checkpoint'
+        if step is None:
+            step = self.steps
+        assert self.checkpoint_step <= step <= self.steps
+        cycles = list(self.checkpoint)
+        for a, b, c, d in self.diffs[:step - self.checkpoint_step]:
+            apply_two_break(cycles, a, b, c, d)
+        return cycles_to_genome(cycles, self.visited)
+
+
+def gen_random_genome(blocks_count, chromosomes_count, rng=random):
+    blocks = [cur_block * rng.choice((-1, 1)) for cur_block in range(1, blocks_count + 1)]
+    rng.shuffle(blocks)
+    cuts = sorted(rng.sample(range(1, blocks_count), chromosomes_count - 1))
+    return [blocks[cur_start:cur_end] for cur_start, cur_end in zip([0] + cuts, cuts + [blocks_count])]
+
+
+def benchmark_two_break(blocks_count=10 ** 5, chromosomes_count=10, steps=100, seed=0):
+    rng = random.Random(seed)
+    start_genome = gen_random_genome(blocks_count, chromosomes_count, rng)
+    final_genome = gen_random_genome(blocks_count, chromosomes_count, rng)
+
+    start_time = time.perf_counter()
+    start_cycle = genome_to_cycle(start_genome)
+    final_cycle = genome_to_cycle(final_genome)
+    print(f'genome_to_cycle: {(time.perf_counter() - start_time) / 2:.3f} s')
+
+    visited = VisitedMarks(len(start_cycle))
+    distance = two_break_distance(start_cycle, final_cycle, visited)
+    late_steps = min(steps, distance)
+    sorter = TwoBreakSorter(start_cycle, final_cycle)
+    start_time = time.perf_counter()
+    for _ in range(distance - late_steps):
+        sorter.apply_next()
+    sorter_time = time.perf_counter() - start_time
+
+    # the first 2-breaks sit next to node 1, so modify_cur_cycles finds them at once; the last
+    # ones take a scan over most of the graph each, which is what the worklist avoids
+    late_cycle = list(start_cycle)
+    start_time = time.perf_counter()
+    for _ in range(late_steps):
+        assert modify_cur_cycles(late_cycle, final_cycle, visited)
+    late_time = time.perf_counter() - start_time
+    print(f'modify_cur_cycles: {late_time / max(late_steps, 1) * 1000:.3f} ms per step for the last {late_steps}')
+
+    start_time = time.perf_counter()
+    assert sorter.sort() == distance
+    sorter_time += time.perf_counter() - start_time
+    print(f'TwoBreakSorter: {sorter_time / max(distance, 1) * 1000:.3f} ms per step for all {distance}')
+    assert start_cycle == late_cycle == final_cycle
+
+    start_time = time.perf_counter()
+    cur_genome = cycles_to_genome(start_cycle, visited)
+    print(f'cycles_to_genome: {time.perf_counter() - start_time:.3f} s')
+    assert sorted(abs(cur_block) for cur_chromosome in cur_genome for cur_block in cur_chromosome) == \
+           list(range(1, blocks_count + 1))
+
+
+def main(mode='text', checkpoint_every=1000):
     start_line, final_line = get_lines('rosalind_ba6d.txt')
     print(start_line)
 
-    start_genome = parse(start_line)
-    final_genome = parse(final_line)
+    start_genome = parse_flat(start_line)
+    final_genome = parse_flat(final_line)
 
     start_cycle = genome_to_cycle(start_genome)
     final_cycle = genome_to_cycle(final_genome)
 
-    while modify_cur_cycles(start_cycle, final_cycle):
-        cur_genome = cycles_to_genome(start_cycle)
-        print(genome_to_string(cur_genome))
+    writer = ScenarioWriter(sys.stdout, start_cycle, mode, checkpoint_every)
+    sorter = TwoBreakSorter(start_cycle, final_cycle)
+    while True:
+        two_break = sorter.apply_next()
+        if two_break is None:
+            break
+        writer.write_step(start_cycle, two_break)
 
 
 if __name__ == '__main__':